@@ -0,0 +1,75 @@
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from recipes.models import User
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from .cache import shared_cache
+
+TOKEN_USER_KEY = 'api:token:{digest}:user'
+
+# Поля пользователя, которые используют API и проверки прав.
+# Остальные поля загружаются отдельным запросом при обращении к ним.
+AUTH_USER_FIELDS = (
+    'id', 'email', 'username', 'first_name', 'last_name', 'avatar',
+    'role', 'is_active', 'is_staff', 'is_superuser',
+)
+
+
+def token_cache_key(key):
+    """Ключ кэша для токена, сам токен в кэше не хранится."""
+    return TOKEN_USER_KEY.format(digest=sha256(key.encode()).hexdigest())
+
+
+def invalidate_tokens(keys):
+    cache.delete_many([token_cache_key(key) for key in keys])
+
+
+def invalidate_user_tokens(user):
+    """Сброс кэша всех токенов пользователя."""
+    invalidate_tokens(
+        Token.objects.filter(user=user).values_list('key', flat=True))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Аутентификация по токену с кэшированием id пользователя.
+
+    Соответствие токен -> id пользователя хранится в кэше
+    TOKEN_CACHE_TIMEOUT секунд, пользователь загружается запросом
+    по первичному ключу только с полями AUTH_USER_FIELDS. Кэш
+    сбрасывается при удалении токена (см. api/signals.py) и смене
+    пароля. Кэш используется, только если он общий для процессов
+    (см. shared_cache), иначе токен проверяется в БД при каждом
+    запросе.
+    """
+
+    def authenticate_credentials(self, key):
+        use_cache = shared_cache()
+        cache_key = token_cache_key(key)
+        user_id = cache.get(cache_key) if use_cache else None
+        if user_id is None:
+            try:
+                token = Token.objects.select_related('user').only(
+                    'key', 'user_id',
+                    *(f'user__{field}' for field in AUTH_USER_FIELDS)
+                ).get(key=key)
+            except Token.DoesNotExist:
+                raise AuthenticationFailed(_('Invalid token.'))
+            user = token.user
+            if use_cache:
+                cache.set(cache_key, user.id, settings.TOKEN_CACHE_TIMEOUT)
+        else:
+            try:
+                user = User.objects.only(*AUTH_USER_FIELDS).get(pk=user_id)
+            except User.DoesNotExist:
+                cache.delete(cache_key)
+                raise AuthenticationFailed(_('Invalid token.'))
+            token = Token(key=key, user=user)
+
+        if not user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        return user, token
@@ -0,0 +1,137 @@
+import time
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from recipes.models import ReferenceVersion, Tag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .metrics import CACHE_REQUESTS
+
+VERSION_KEY = 'api:{name}:version'
+RESPONSE_KEY = 'api:{name}:{version}:{path}'
+TAG_IDS_KEY = 'api:tags:{version}:ids'
+
+
+def shared_cache():
+    """Общий ли кэш для всех процессов.
+
+    Локальный кэш процесса не видит изменений, сделанных в других
+    процессах.
+    """
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def version_timeout():
+    """Время хранения версии в кэше.
+
+    В общем кэше версия хранится без срока и меняется только
+    bump_version. Локальный кэш процесса перечитывает ее из БД
+    через REFERENCE_CACHE_TIMEOUT, чтобы увидеть изменения из других
+    процессов; если данные не менялись, версия остается прежней.
+    """
+    return None if shared_cache() else settings.REFERENCE_CACHE_TIMEOUT
+
+
+def get_version(name):
+    """Версия набора данных name.
+
+    Версия — время последнего изменения данных (ReferenceVersion).
+    """
+    key = VERSION_KEY.format(name=name)
+    version = cache.get(key)
+    if version is None:
+        version = ReferenceVersion.objects.get_or_create(
+            name=name, defaults={'version': time.time()})[0].version
+        cache.set(key, version, version_timeout())
+    return version
+
+
+def bump_version(name):
+    """Новая версия набора данных, прежние ответы перестают быть актуальны.
+
+    Каждая следующая версия больше предыдущей хотя бы на секунду,
+    поэтому Last-Modified (целые секунды) всегда растет.
+    """
+    now = time.time()
+    updated = ReferenceVersion.objects.filter(name=name).update(
+        version=Greatest(Value(now), F('version') + 1))
+    if not updated:
+        ReferenceVersion.objects.get_or_create(
+            name=name, defaults={'version': now})
+    version = ReferenceVersion.objects.values_list(
+        'version', flat=True).get(name=name)
+    cache.set(VERSION_KEY.format(name=name), version, version_timeout())
+    return version
+
+
+def get_tag_ids(slugs):
+    """Словарь slug -> id для известных тегов из slugs.
+
+    Словарь всех тегов хранится в кэше с версией набора тегов,
+    неизвестных slug в результате нет.
+    """
+    key = TAG_IDS_KEY.format(version=get_version('tags'))
+    tag_ids = cache.get(key)
+    CACHE_REQUESTS.labels(
+        'tag_ids', 'miss' if tag_ids is None else 'hit').inc()
+    if tag_ids is None:
+        tag_ids = dict(Tag.objects.values_list('slug', 'id'))
+        cache.set(key, tag_ids, settings.REFERENCE_CACHE_TIMEOUT)
+    return {slug: tag_ids[slug] for slug in slugs if slug in tag_ids}
+
+
+class CachedResponseMixin:
+    """Кэширование ответов list и retrieve для справочных данных.
+
+    Ответы хранятся в кэше под ключом с версией набора данных
+    и отдаются с заголовками ETag и Last-Modified. На условные
+    запросы с актуальной версией возвращается 304 Not Modified.
+    """
+
+    cache_name = None
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            request, super().retrieve, *args, **kwargs)
+
+    def get_cached_response(self, request, view, *args, **kwargs):
+        version = get_version(self.cache_name)
+        path = md5(request.get_full_path().encode()).hexdigest()
+        etag = quote_etag(md5(f'{version}:{path}'.encode()).hexdigest())
+        last_modified = int(version)
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            key = RESPONSE_KEY.format(
+                name=self.cache_name, version=version, path=path)
+            data = cache.get(key)
+            CACHE_REQUESTS.labels(
+                self.cache_name, 'miss' if data is None else 'hit').inc()
+            if data is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(key, response.data,
+                          settings.REFERENCE_CACHE_TIMEOUT)
+            else:
+                response = Response(data)
+        else:
+            CACHE_REQUESTS.labels(self.cache_name, 'not_modified').inc()
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, public=True, no_cache=True)
+        return response
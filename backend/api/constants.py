@@ -13,6 +13,8 @@ MAX_COLOR_LENGTH = 7
 MAX_MEASUREMENT_UNIT_LENGTH = 200
 
 COLOR_HAVE_NO_NAME = 'У этого цвета нет имени'
+IMAGE_TOO_LARGE = 'Размер изображения не должен превышать {max_size} МБ'
+INVALID_IMAGE_DATA = 'Изображение должно быть в формате data:image/...;base64'
 MIN_COOKING_TIME = 1
 MAX_COOKING_TIME = 20000
 MIN_COOKING_TIME_WARNING = 'Блюдо не может готовиться меньше 1 минуты'
@@ -45,9 +47,10 @@ RECIPE_NOT_IN_SHOPPING_LIST = 'Рецепта "{recipe}" нет в списке
 NO_RECIPES_TO_GENERATE_SHOPPING_LIST = (
     'У вас нет рецептов для генерации списка покупок.')
 INVALID_PASSWORD = 'Неправильный пароль'
+INVALID_CURSOR = 'Неверный курсор'
+INVALID_INGREDIENT_IDS = 'Укажите id ингредиентов числами через запятую'
 HAVE_NO_AVATAR = 'Аватар не установлен.'
 METHOD_NOT_ALLOWED = 'Этот метод запрещен.'
-UNEXPECTED_FORMAT_OF_DATA = 'Неожиданный формат данных для ингредиентов.'
 SUCCESSFULLY_FAVORITED = 'Рецепт "{recipe}" успешно добавлен в избранное'
 SUCCESSFULLY_DELETED_FAVORITE = (
     'Рецепт "{recipe}" успешно удален из избранного')
@@ -55,7 +58,14 @@ SUCCESSFULLY_ADDED_TO_SHOPPING_LIST = (
     'Рецепт "{recipe}" успешно добавлен в список покупок')
 SUCCESSFULLY_DELETED_FROM_SHOPPING_LIST = (
     'Рецепт "{recipe}" успешно удален из списка покупок')
-NAME_KEY = 'recipe__recipe_ingredients__ingredient__name'
-UNIT_KEY = 'recipe__recipe_ingredients__ingredient__measurement_unit'
+INGREDIENT_KEY = 'ingredient'
+NAME_KEY = 'ingredient__name'
+UNIT_KEY = 'ingredient__measurement_unit'
 TOTAL_KEY = 'total'
-AMOUNT_KEY = 'recipe__recipe_ingredients__amount'
+AMOUNT_KEY = 'amount'
+SHOPPING_LIST_CHUNK_SIZE = 500
+# Нечеткий поиск ингредиентов: порог сходства совпадает
+# с pg_trgm.similarity_threshold по умолчанию.
+FUZZY_SEARCH_LIMIT = 10
+MAX_FUZZY_SEARCH_LIMIT = 50
+FUZZY_SIMILARITY_THRESHOLD = 0.3
@@ -1,15 +1,18 @@
-from django_filters.rest_framework import CharFilter, FilterSet, filters
-from recipes.models import Ingredient, Recipe, Tag
+from django.forms import ModelMultipleChoiceField
+from django_filters.rest_framework import FilterSet, filters
+from recipes.models import Recipe
+from recipes.search import search_recipes
+from rest_framework.exceptions import ValidationError
 
+from .cache import get_tag_ids
 
-class IngredientFilter(FilterSet):
-    """Поиск по ингредиенту."""
-
-    name = CharFilter(lookup_expr='istartswith')
-
-    class Meta:
-        model = Ingredient
-        fields = ('name',)
+# Сортировки ленты рецептов: последнее поле уникально,
+# чтобы по ним работал постраничный вывод по ключу.
+RECIPE_ORDERINGS = {
+    'new': ('-pub_date', '-id'),
+    'popular': ('-favorites_count', '-id'),
+    'cooking_time': ('cooking_time', 'id'),
+}
 
 
 class RecipeFilter(FilterSet):
@@ -21,15 +24,17 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart'
     )
-    tags = filters.ModelMultipleChoiceFilter(
-        queryset=Tag.objects.all(),
-        field_name='tags__slug',
-        to_field_name='slug',
+    tags = filters.CharFilter(method='get_tags')
+    search = filters.CharFilter(method='get_search')
+    ordering = filters.ChoiceFilter(
+        choices=tuple((name, name) for name in RECIPE_ORDERINGS),
+        method='get_ordering'
     )
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart',
+                  'search', 'ordering')
 
     def get_is_favorite(self, queryset, name, value):
         if self.request.user.is_authenticated and value:
@@ -40,3 +45,33 @@ class RecipeFilter(FilterSet):
         if self.request.user.is_authenticated and value:
             return queryset.filter(shopping_list__user=self.request.user)
         return queryset
+
+    def get_tags(self, queryset, name, value):
+        """Рецепты хотя бы с одним из тегов ?tags=...&tags=....
+
+        Теги проверяются подзапросом к промежуточной таблице,
+        поэтому рецепт с несколькими тегами не повторяется в выдаче
+        и DISTINCT не нужен. Неизвестный slug отклоняется с ошибкой 400.
+        """
+        slugs = self.data.getlist(name)
+        tag_ids = get_tag_ids(slugs)
+        unknown = [slug for slug in slugs if slug not in tag_ids]
+        if unknown:
+            raise ValidationError({name: [
+                ModelMultipleChoiceField.default_error_messages[
+                    'invalid_choice'] % {'value': slug}
+                for slug in unknown
+            ]})
+        return queryset.filter(id__in=Recipe.tags.through.objects.filter(
+            tag_id__in=tag_ids.values()).values('recipe_id'))
+
+    def get_search(self, queryset, name, value):
+        """Полнотекстовый поиск, результаты отсортированы по релевантности.
+
+        Явно заданный ?ordering применяется после поиска и заменяет
+        сортировку по релевантности.
+        """
+        return search_recipes(queryset, value)
+
+    def get_ordering(self, queryset, name, value):
+        return queryset.order_by(*RECIPE_ORDERINGS[value])
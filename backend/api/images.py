@@ -0,0 +1,127 @@
+"""Уменьшенные копии изображений рецептов и аватаров.
+
+Копии строятся фоновым пулом потоков после сохранения модели
+(см. api/signals.py) и лежат рядом с оригиналом под предсказуемым
+именем, поэтому сериализаторы находят их без обращения к БД.
+Найденные копии запоминаются в кэше (см. variant_urls).
+Размер очереди ограничен: если она заполнена, копии будут созданы
+командой generate_image_variants.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from threading import BoundedSemaphore
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+# Максимальные ширина и высота копий.
+VARIANT_SIZES = {
+    'card': (480, 480),
+    'detail': (1200, 1200),
+    'avatar': (256, 256),
+}
+RECIPE_IMAGE_VARIANTS = ('card', 'detail')
+AVATAR_VARIANTS = ('avatar',)
+
+# Pillow без libwebp не умеет сохранять WebP, тогда копии хранятся в JPEG.
+VARIANT_FORMAT, VARIANT_EXTENSION = (
+    ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg'))
+VARIANT_QUALITY = 80
+
+VARIANT_KEY = 'images:variant:{name}'
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_WORKERS, thread_name_prefix='image-variants')
+queue_slots = BoundedSemaphore(settings.IMAGE_QUEUE_SIZE)
+
+
+def variant_name(name, variant):
+    """Имя копии: recipes/images/x.png -> recipes/images/x.card.webp."""
+    root, _ = os.path.splitext(name)
+    return f'{root}.{variant}.{VARIANT_EXTENSION}'
+
+
+def variant_key(name):
+    return VARIANT_KEY.format(name=name)
+
+
+def variant_urls(image, variants, request=None):
+    """Ссылки на уже созданные копии изображения.
+
+    Имена файлов зависят от содержимого и не меняются, поэтому
+    найденная копия запоминается в кэше без срока. Хранилище
+    проверяется только для копий, которых в кэше еще нет.
+    """
+    if not image:
+        return {}
+    names = {
+        variant: variant_name(image.name, variant) for variant in variants}
+    known = cache.get_many([variant_key(name) for name in names.values()])
+    found = {}
+    urls = {}
+    for variant, name in names.items():
+        if variant_key(name) not in known:
+            if not image.storage.exists(name):
+                continue
+            found[variant_key(name)] = True
+        url = image.storage.url(name)
+        urls[variant] = request.build_absolute_uri(url) if request else url
+    if found:
+        cache.set_many(found, None)
+    return urls
+
+
+def generate_variants(name, variants, storage=default_storage):
+    """Создание недостающих копий изображения name.
+
+    Возвращает количество созданных копий.
+    """
+    missing = [
+        variant for variant in variants
+        if not storage.exists(variant_name(name, variant))
+    ]
+    if not missing or not storage.exists(name):
+        return 0
+    with storage.open(name) as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image = image.convert(
+            'RGBA' if VARIANT_FORMAT == 'WEBP' and 'A' in image.getbands()
+            else 'RGB')
+    for variant in missing:
+        copy = image.copy()
+        copy.thumbnail(VARIANT_SIZES[variant], Image.LANCZOS)
+        buffer = BytesIO()
+        copy.save(buffer, VARIANT_FORMAT, quality=VARIANT_QUALITY)
+        storage.save(
+            variant_name(name, variant), ContentFile(buffer.getvalue()))
+    cache.set_many({
+        variant_key(variant_name(name, variant)): True
+        for variant in missing
+    }, None)
+    return len(missing)
+
+
+def schedule_variants(name, variants):
+    """Постановка создания копий в очередь фонового пула."""
+    if not name:
+        return None
+    if not queue_slots.acquire(blocking=False):
+        logger.warning('Очередь обработки изображений заполнена: %s', name)
+        return None
+    future = executor.submit(generate_variants, name, variants)
+    future.add_done_callback(variants_done)
+    return future
+
+
+def variants_done(future):
+    queue_slots.release()
+    if future.exception() is not None:
+        logger.error(
+            'Ошибка обработки изображения', exc_info=future.exception())
@@ -0,0 +1,267 @@
+import re
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from datetime import timedelta
+from heapq import merge, nsmallest
+from itertools import groupby
+from threading import Lock
+
+from django.utils import timezone
+from recipes.models import (Ingredient, RecipeIngredient,
+                            RecipeIngredientsChange)
+
+MAX_CHAR = '\U0010ffff'
+WORD_RE = re.compile(r'[^\W_]+')
+
+# Журнал изменений ингредиентов рецептов (см. RecipeIngredientIndex).
+CHANGES_OVERLAP = timedelta(minutes=5)
+CHANGES_RETENTION = timedelta(days=1)
+CHANGES_PRUNE_INTERVAL = timedelta(hours=1)
+
+
+def trigrams(text):
+    """Триграммы строки по правилам pg_trgm.
+
+    Каждое слово в нижнем регистре дополняется двумя пробелами
+    в начале и одним в конце.
+    """
+    result = set()
+    for word in WORD_RE.findall(text.lower()):
+        word = f'  {word} '
+        result.update(word[index:index + 3] for index in range(len(word) - 2))
+    return result
+
+
+class VersionedIndex:
+    """Индекс в памяти процесса, привязанный к версии набора данных.
+
+    Индекс строится методом load при первом обращении и сбрасывается
+    через invalidate. Если передана версия набора данных из кэша
+    (см. api/cache.py), индекс перестраивается при ее смене, в том
+    числе в других процессах. Счетчик _generation не дает сборке,
+    начатой до сброса, сохранить устаревшее состояние.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._state = None
+        self._version = None
+        self._generation = 0
+
+    def load(self):
+        raise NotImplementedError
+
+    def build(self, version=None):
+        """Загрузка данных из базы данных."""
+        generation = self._generation
+        state = self.load()
+        if generation == self._generation:
+            self._state = state
+            self._version = version
+        return state
+
+    def get_state(self, version=None):
+        state = self._state
+        if state is None or version != self._version:
+            with self._lock:
+                state = self._state
+                if state is None or version != self._version:
+                    state = self.build(version)
+        return state
+
+    def invalidate(self):
+        """Сброс индекса, он будет построен заново при следующем поиске."""
+        self._generation += 1
+        self._state = None
+
+
+class IngredientIndex(VersionedIndex):
+    """Индекс названий ингредиентов.
+
+    Названия в нижнем регистре хранятся в отсортированном списке,
+    поиск по префиксу выполняется двоичным поиском.
+    Для нечеткого поиска хранятся триграммы названий и списки
+    ингредиентов по каждой триграмме. Индекс сбрасывается
+    при изменении ингредиентов (см. api/signals.py).
+    """
+
+    def load(self):
+        items = sorted(
+            Ingredient.objects.values('id', 'name', 'measurement_unit'),
+            key=lambda item: (item['name'].lower(), item['id'])
+        )
+        keys = [item['name'].lower() for item in items]
+        item_trigrams = [trigrams(key) for key in keys]
+        postings = defaultdict(list)
+        for index, item_trigram in enumerate(item_trigrams):
+            for trigram in item_trigram:
+                postings[trigram].append(index)
+        return keys, items, item_trigrams, dict(postings)
+
+    def search(self, prefix='', limit=None, version=None):
+        """Ингредиенты, название которых начинается с prefix."""
+        keys, items, _, _ = self.get_state(version)
+        prefix = prefix.lower()
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + MAX_CHAR, lo=start)
+        if limit is not None:
+            end = min(end, start + limit)
+        return items[start:end]
+
+    def fuzzy_search(self, query, limit, threshold, version=None):
+        """Ингредиенты, похожие на query, по убыванию сходства.
+
+        Сходство считается как в pg_trgm similarity(): доля общих
+        триграмм от их объединения. Учитываются только ингредиенты,
+        у которых есть хотя бы одна общая триграмма с запросом.
+        """
+        keys, items, item_trigrams, postings = self.get_state(version)
+        query_trigrams = trigrams(query)
+        common = Counter()
+        for trigram in query_trigrams:
+            common.update(postings.get(trigram, ()))
+        scored = []
+        for index, count in common.items():
+            similarity = count / (
+                len(query_trigrams) + len(item_trigrams[index]) - count)
+            if similarity >= threshold:
+                scored.append((-similarity, keys[index], index))
+        scored.sort()
+        return [items[index] for _, _, index in scored[:limit]]
+
+
+class RecipeIngredientIndex(VersionedIndex):
+    """Обратный индекс ингредиент -> рецепты.
+
+    Для каждого ингредиента хранится отсортированный массив id рецептов,
+    для каждого рецепта — кортеж id его ингредиентов. Рецепты
+    с нужными ингредиентами находятся слиянием массивов без запросов
+    к ингредиентам рецептов.
+
+    Изменения ингредиентов записываются в журнал RecipeIngredientsChange
+    (см. ShoppingListItem.changing_recipes и RecipeQuerySet.prepare_delete
+    в recipes/models.py). Перед поиском индекс читает новые записи
+    журнала и перезагружает из БД только измененные рецепты, поэтому
+    изменения видны всем процессам без перестроения индекса. Журнал
+    читается с запасом CHANGES_OVERLAP, чтобы не пропустить транзакции,
+    зафиксированные позже начатых после них. Повторное применение
+    записи безопасно: рецепт просто загружается заново. Индекс,
+    который не читал журнал дольше срока его хранения, строится заново.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._synced = None
+        self._seen = set()
+        self._pruned = None
+
+    def load(self):
+        postings = defaultdict(lambda: array('q'))
+        recipes = defaultdict(list)
+        for ingredient_id, recipe_id in RecipeIngredient.objects.order_by(
+                'ingredient_id', 'recipe_id'
+        ).values_list('ingredient_id', 'recipe_id').iterator():
+            postings[ingredient_id].append(recipe_id)
+            recipes[recipe_id].append(ingredient_id)
+        return dict(postings), {
+            recipe_id: tuple(ingredient_ids)
+            for recipe_id, ingredient_ids in recipes.items()
+        }
+
+    @staticmethod
+    def read_changes(since):
+        """Записи журнала {id записи: id рецепта} начиная с since."""
+        return dict(RecipeIngredientsChange.objects.filter(
+            created__gte=since - CHANGES_OVERLAP
+        ).values_list('id', 'recipe_id'))
+
+    def get_state(self, version=None):
+        with self._lock:
+            now = timezone.now()
+            if self._state is None or (
+                    now - self._synced > CHANGES_RETENTION - CHANGES_OVERLAP):
+                # Журнал читается до загрузки индекса: изменения,
+                # попавшие между чтениями, будут применены повторно.
+                self._synced = now
+                self._seen = set(self.read_changes(now))
+                self.build()
+                self.prune(now)
+            else:
+                self.sync(now)
+            return self._state
+
+    def sync(self, now):
+        """Применение новых записей журнала."""
+        changes = self.read_changes(self._synced)
+        recipe_ids = {
+            recipe_id for change_id, recipe_id in changes.items()
+            if change_id not in self._seen
+        }
+        self._synced, self._seen = now, set(changes)
+        if recipe_ids:
+            ingredients = defaultdict(list)
+            for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+                    recipe_id__in=recipe_ids
+            ).values_list('recipe_id', 'ingredient_id'):
+                ingredients[recipe_id].append(ingredient_id)
+            for recipe_id in recipe_ids:
+                self.replace_recipe(recipe_id, ingredients[recipe_id])
+        if now - self._pruned > CHANGES_PRUNE_INTERVAL:
+            self.prune(now)
+
+    def prune(self, now):
+        """Удаление записей журнала старше срока хранения."""
+        RecipeIngredientsChange.objects.filter(
+            created__lt=now - CHANGES_RETENTION).delete()
+        self._pruned = now
+
+    def replace_recipe(self, recipe_id, ingredient_ids):
+        """Замена ингредиентов рецепта, пустой список удаляет рецепт."""
+        postings, recipes = self._state
+        for ingredient_id in recipes.pop(recipe_id, ()):
+            recipe_ids = postings[ingredient_id]
+            del recipe_ids[bisect_left(recipe_ids, recipe_id)]
+        for ingredient_id in ingredient_ids:
+            insort(postings.setdefault(ingredient_id, array('q')), recipe_id)
+        if ingredient_ids:
+            recipes[recipe_id] = tuple(ingredient_ids)
+
+    def search(self, ingredient_ids, offset=0, limit=None):
+        """Рецепты хотя бы с одним из ингредиентов ingredient_ids.
+
+        Возвращает количество найденных рецептов и страницу
+        из limit кортежей (id рецепта, сколько ингредиентов из запроса
+        есть в рецепте, скольких ингредиентов рецепта нет в запросе):
+        сначала рецепты с наибольшим покрытием, затем с наименьшим
+        числом недостающих ингредиентов, затем более новые. Полный
+        список не сортируется, выбираются только offset + limit лучших.
+        """
+        postings, recipes = self.get_state()
+        merged = merge(*(
+            postings[ingredient_id] for ingredient_id in set(ingredient_ids)
+            if ingredient_id in postings
+        ))
+        count = 0
+
+        def matches():
+            nonlocal count
+            for recipe_id, group in groupby(merged):
+                coverage = sum(1 for _ in group)
+                count += 1
+                yield (
+                    -coverage, len(recipes[recipe_id]) - coverage,
+                    -recipe_id)
+
+        if limit is None:
+            best = sorted(matches())
+        else:
+            best = nsmallest(offset + limit, matches())
+        return count, [
+            (-recipe_id, -coverage, missing)
+            for coverage, missing, recipe_id in best[offset:]
+        ]
+
+
+ingredient_index = IngredientIndex()
+recipe_ingredient_index = RecipeIngredientIndex()
@@ -0,0 +1,48 @@
+"""Метрики API в формате Prometheus.
+
+Если задана переменная окружения PROMETHEUS_MULTIPROC_DIR,
+prometheus_client хранит значения каждого процесса gunicorn в файлах
+этого каталога, а эндпоинт /api/metrics суммирует их по всем
+процессам (см. gunicorn.conf.py).
+"""
+import os
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+
+REQUESTS = Counter(
+    'api_requests_total', 'Запросы к API',
+    ('view', 'method', 'status'))
+REQUEST_DURATION = Histogram(
+    'api_request_duration_seconds', 'Время обработки запроса',
+    ('view',))
+DB_QUERIES = Histogram(
+    'api_db_queries', 'SQL-запросы на один запрос к API', ('view',),
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55, 89))
+CACHE_REQUESTS = Counter(
+    'api_cache_requests_total', 'Обращения к кэшу справочных данных',
+    ('name', 'result'))
+UPLOAD_SIZE = Histogram(
+    'api_upload_size_bytes', 'Размер загруженных изображений',
+    buckets=tuple(2 ** power * 1024 for power in range(4, 14)))
+
+
+def view_name(view_func, method):
+    """Имя view для меток: RecipeViewSet.list, UserViewSet.subscriptions."""
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return view_func.__name__
+    action = (getattr(view_func, 'actions', None) or {}).get(method.lower())
+    if action is None:
+        return view_class.__name__
+    return f'{view_class.__name__}.{action}'
+
+
+def latest_metrics():
+    """Метрики в текстовом формате и его Content-Type."""
+    registry = REGISTRY
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,169 @@
+"""Измерение времени обработки запросов и числа SQL-запросов.
+
+MetricsMiddleware собирает метрики Prometheus (см. api/metrics.py).
+
+RequestTimingMiddleware включается настройкой REQUEST_TIMING. Для
+каждого запроса считаются запросы к БД и их суммарное время, время
+работы view без сериализации, время сериализации ответа (свойство data
+внешнего сериализатора, см. time_serializers; сериализаторы DRF
+оборачиваются только при включенной настройке), время рендеринга
+ответа и общее время. Значения отдаются в заголовке Server-Timing и пишутся
+в лог api.requests одной строкой JSON. Запросы, выполнившие больше
+REQUEST_QUERY_BUDGET SQL-запросов, пишутся в лог с уровнем WARNING.
+"""
+import json
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.serializers import ListSerializer, Serializer
+
+from . import metrics
+
+logger = logging.getLogger('api.requests')
+
+
+class QueryTimer:
+    """Обертка execute_wrapper: число и суммарное время SQL-запросов."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+def timed_data(data):
+    """Свойство data, добавляющее время сериализации в request.timing.
+
+    Учитывается только внешний сериализатор: вложенные вызовы data
+    (например, в to_representation) входят в его время.
+    """
+    def wrapper(serializer):
+        timing = getattr(serializer.context.get('request'), 'timing', None)
+        if timing is None or timing.get('serializing'):
+            return data.fget(serializer)
+        timing['serializing'] = True
+        start = time.perf_counter()
+        try:
+            return data.fget(serializer)
+        finally:
+            timing['serializing'] = False
+            timing['serialize'] = (
+                timing.get('serialize', 0.0) + time.perf_counter() - start)
+    wrapper.timed = True
+    return property(wrapper)
+
+
+def time_serializers():
+    """Подключение timed_data к сериализаторам DRF.
+
+    Вызывается при создании RequestTimingMiddleware, то есть только
+    с REQUEST_TIMING; повторный вызов ничего не меняет.
+    """
+    for serializer_class in (Serializer, ListSerializer):
+        if not getattr(serializer_class.data.fget, 'timed', False):
+            serializer_class.data = timed_data(serializer_class.data)
+
+
+class RequestTimingMiddleware:
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING:
+            raise MiddlewareNotUsed
+        time_serializers()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        request.timing = {}
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        end = time.perf_counter()
+
+        timing = request.timing
+        durations = {'db': timer.duration}
+        if 'view_start' in timing:
+            view_end = timing.get('view_end', end)
+            durations['view'] = (
+                view_end - timing['view_start'] - timing.get('serialize', 0))
+            if 'serialize' in timing:
+                durations['serialize'] = timing['serialize']
+            if 'render_end' in timing:
+                durations['render'] = timing['render_end'] - view_end
+        durations['total'] = end - start
+        response['Server-Timing'] = ', '.join(
+            f'{name};dur={duration * 1000:.1f}' + (
+                f';desc="{timer.count} queries"' if name == 'db' else '')
+            for name, duration in durations.items()
+        )
+        self.log(request, response, timer.count, durations)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.timing['view_start'] = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        request.timing['view_end'] = time.perf_counter()
+        response.add_post_render_callback(
+            lambda response: request.timing.update(
+                render_end=time.perf_counter()))
+        return response
+
+    @staticmethod
+    def log(request, response, queries, durations):
+        resolver_match = request.resolver_match
+        over_budget = queries > settings.REQUEST_QUERY_BUDGET
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': resolver_match.view_name if resolver_match else None,
+            'status': response.status_code,
+            'queries': queries,
+            'over_budget': over_budget,
+            **{
+                f'{name}_ms': round(duration * 1000, 1)
+                for name, duration in durations.items()
+            },
+        }
+        logger.log(
+            logging.WARNING if over_budget else logging.INFO,
+            json.dumps(record, ensure_ascii=False))
+
+
+class MetricsMiddleware:
+    """Счетчики запросов, время обработки и число SQL-запросов по view."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        request.metrics_view = None
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        view = request.metrics_view or 'unknown'
+        metrics.REQUESTS.labels(
+            view, request.method, response.status_code).inc()
+        metrics.REQUEST_DURATION.labels(view).observe(
+            time.perf_counter() - start)
+        metrics.DB_QUERIES.labels(view).observe(timer.count)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_view = metrics.view_name(view_func, request.method)
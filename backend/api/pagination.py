@@ -0,0 +1,199 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination, LimitOffsetPagination,
+                                       PageNumberPagination)
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .constants import INVALID_CURSOR
+
+PAGINATION_QUERY_PARAM = 'pagination'
+CURSOR_PAGINATION = 'cursor'
+
+
+class KeysetPagination(BasePagination):
+    """Постраничный вывод по ключу.
+
+    Следующая страница выбирается условием на значения полей сортировки
+    последней записи предыдущей страницы, поэтому база не пропускает
+    строки через OFFSET и не считает их количество через COUNT(*).
+    Последним полем сортировки должен быть уникальный ключ.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    ordering = ('-id',)
+
+    def __init__(self, page_size):
+        self.page_size = page_size
+
+    def get_ordering(self, queryset):
+        """Сортировка запроса, модели или ordering по умолчанию."""
+        ordering = tuple(
+            queryset.query.order_by or queryset.model._meta.ordering
+            or self.ordering
+        )
+        if ordering[-1].lstrip('-') != 'id':
+            ordering += ('-id' if ordering[-1].startswith('-') else 'id',)
+        return ordering
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(position))
+
+        page = list(queryset[:self.page_size + 1])
+        self.next_position = None
+        if len(page) > self.page_size:
+            page = page[:self.page_size]
+            self.next_position = [
+                self.dump_value(queryset.model, field.lstrip('-'), page[-1])
+                for field in self.ordering
+            ]
+        return page
+
+    def get_position_filter(self, position):
+        """Условие «после позиции» для составного ключа сортировки."""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    @staticmethod
+    def dump_value(model, name, obj):
+        """Значение поля сортировки для курсора.
+
+        Поля модели сохраняются строкой без потери точности,
+        аннотации (например, релевантность поиска) — как есть.
+        """
+        try:
+            return model._meta.get_field(name).value_to_string(obj)
+        except FieldDoesNotExist:
+            return getattr(obj, name)
+
+    @staticmethod
+    def load_value(model, name, value):
+        try:
+            return model._meta.get_field(name).to_python(value)
+        except FieldDoesNotExist:
+            return value
+
+    def decode_cursor(self, request, model):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(cursor.encode()))
+            if len(position) != len(self.ordering):
+                raise ValueError
+            return [
+                self.load_value(model, field.lstrip('-'), value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(INVALID_CURSOR)
+
+    def encode_cursor(self, position):
+        cursor = urlsafe_b64encode(
+            json.dumps(position).encode()).decode()
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param, cursor
+        )
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+
+class SelectablePaginationMixin:
+    """Выбор постраничного вывода по ключу параметром ?pagination=cursor.
+
+    Без параметра используется пагинация базового класса, поэтому
+    существующие клиенты продолжают работать как раньше.
+    """
+
+    keyset_class = KeysetPagination
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (request.query_params.get(PAGINATION_QUERY_PARAM)
+                != CURSOR_PAGINATION):
+            self.keyset = None
+            return super().paginate_queryset(queryset, request, view)
+        self.keyset = self.keyset_class(self.page_size)
+        return self.keyset.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class RecipePagination(SelectablePaginationMixin, PageNumberPagination):
+    """Номера страниц или курсор по полям сортировки рецептов."""
+
+
+class UserKeysetPagination(KeysetPagination):
+    ordering = ('id',)
+
+
+class UserPagination(SelectablePaginationMixin, LimitOffsetPagination):
+    """limit/offset или курсор по id пользователей.
+
+    Подписки сортируются по дате подписки, курсор строится
+    по (pub_date, id) модели Follow.
+    """
+
+    keyset_class = UserKeysetPagination
+    page_size = LimitOffsetPagination.default_limit
+
+
+class PrecomputedPage:
+    """Последовательность для пагинатора с заранее посчитанной страницей.
+
+    search(offset, limit) возвращает общее количество и элементы
+    страницы за один проход, так что пагинатору не нужен
+    полный список.
+    """
+
+    def __init__(self, search, offset, limit):
+        self.search = search
+        self.offset = offset
+        self.total, self.items = search(offset, limit)
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, item):
+        if item.start != self.offset:
+            _, items = self.search(item.start, item.stop - item.start)
+            return items
+        return self.items[:item.stop - item.start]
@@ -0,0 +1,93 @@
+import csv
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+from .constants import NAME_KEY, TOTAL_KEY, UNIT_KEY
+
+SHOPPING_LIST_HEADER = 'Список покупок:\n'
+CSV_HEADER = ('Ингредиент', 'Количество', 'Единица измерения')
+
+
+class Echo:
+    """Псевдобуфер для csv.writer: возвращает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Базовый рендерер списка покупок.
+
+    Строки формируются генератором render_lines, поэтому список
+    можно отдавать потоком (см. stream), не собирая его в памяти.
+    """
+
+    charset = 'utf-8'
+    lines_per_chunk = 100
+
+    def render_lines(self, ingredients):
+        raise NotImplementedError
+
+    def render_error(self, data):
+        return ''.join(f'{value}\n' for value in data.values())
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            return self.render_error(data).encode(self.charset)
+        return b''.join(self.stream(data))
+
+    def stream(self, ingredients):
+        """Список покупок, закодированный частями по lines_per_chunk строк."""
+        lines = []
+        for line in self.render_lines(ingredients):
+            lines.append(line)
+            if len(lines) == self.lines_per_chunk:
+                yield ''.join(lines).encode(self.charset)
+                lines = []
+        if lines:
+            yield ''.join(lines).encode(self.charset)
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def render_lines(self, ingredients):
+        yield SHOPPING_LIST_HEADER
+        for ingredient in ingredients:
+            yield '{} - {} ({})\n'.format(
+                ingredient[NAME_KEY], ingredient[TOTAL_KEY],
+                ingredient[UNIT_KEY])
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def render_lines(self, ingredients):
+        writer = csv.writer(Echo())
+        yield writer.writerow(CSV_HEADER)
+        for ingredient in ingredients:
+            yield writer.writerow((
+                ingredient[NAME_KEY], ingredient[TOTAL_KEY],
+                ingredient[UNIT_KEY]))
+
+
+class ShoppingListJSONRenderer(ShoppingListRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def render_error(self, data):
+        return json.dumps(data, ensure_ascii=False)
+
+    def render_lines(self, ingredients):
+        separator = '[\n'
+        for ingredient in ingredients:
+            yield separator + json.dumps({
+                'name': ingredient[NAME_KEY],
+                'amount': ingredient[TOTAL_KEY],
+                'measurement_unit': ingredient[UNIT_KEY],
+            }, ensure_ascii=False)
+            separator = ',\n'
+        yield '[]\n' if separator == '[\n' else '\n]\n'
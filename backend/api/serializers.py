@@ -2,7 +2,9 @@ from django.db import transaction
 from djoser.serializers import UserCreateSerializer
 from djoser.serializers import UserSerializer as BaseUserSerializer
 from recipes.models import (Favorite, Follow, Ingredient, Recipe,
-                            RecipeIngredient, ShoppingList, Tag, User)
+                            RecipeIngredient, RecipeIngredientsChange,
+                            ShoppingList, ShoppingListItem, Tag, User,
+                            change_counter)
 from recipes.validators import (ingredient_amount_validator,
                                 unique_ingredients_validator)
 from rest_framework import serializers
@@ -12,6 +14,7 @@ from rest_framework.serializers import ModelSerializer, ValidationError
 from .constants import (ALREADY_SUBSCRIBED, CANT_SUBSCRIBE_TO_YOURSELF,
                         INVALID_PASSWORD, RECIPE_ALREADY_EXISTS_IN_FAVORITES,
                         RECIPE_ALREADY_EXISTS_IN_SHOPPING_LIST)
+from .images import AVATAR_VARIANTS, RECIPE_IMAGE_VARIANTS, variant_urls
 from .serializers_fields import Base64ImageField, Hex2NameColor
 
 
@@ -37,19 +40,39 @@ class UserSerializer(BaseUserSerializer):
     """Сериализатор пользователей."""
 
     is_subscribed = serializers.SerializerMethodField()
+    avatar_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = User
         fields = ('email', 'id', 'username', 'first_name',
-                  'last_name', 'avatar', 'is_subscribed')
+                  'last_name', 'avatar', 'avatar_variants', 'is_subscribed')
+
+    @staticmethod
+    def get_subscriptions(request):
+        """Id авторов, на которых подписан пользователь.
+
+        Загружаются одним запросом и хранятся на объекте запроса,
+        чтобы все сериализаторы пользователей в ответе
+        использовали общий результат.
+        """
+        subscriptions = getattr(request, 'subscriptions', None)
+        if subscriptions is None:
+            subscriptions = set(
+                request.user.follower.values_list('author_id', flat=True))
+            request.subscriptions = subscriptions
+        return subscriptions
 
     def get_is_subscribed(self, author):
         """Проверка подписки."""
-        user = self.context['request'].user
-        return (
-            not user.is_anonymous and user.follower.filter(
-                author=author).exists()
-        )
+        request = self.context.get('request')
+        if request is None or request.user.is_anonymous:
+            return False
+        return author.id in self.get_subscriptions(request)
+
+    def get_avatar_variants(self, user):
+        """Ссылки на уменьшенные копии аватара."""
+        return variant_urls(
+            user.avatar, AVATAR_VARIANTS, self.context.get('request'))
 
 
 class CreateUserSerializer(UserCreateSerializer):
@@ -108,29 +131,39 @@ class RecipeSerializer(serializers.ModelSerializer):
         source='recipe_ingredients', many=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'tags', 'author', 'image',
+        fields = ('id', 'name', 'tags', 'author', 'image', 'image_variants',
                   'ingredients', 'is_favorited',
                   'is_in_shopping_cart', 'text', 'cooking_time'
                   )
 
     def get_is_favorited(self, recipe):
         """Проверка на добавление в избранное."""
-        request = self.context['request']
-        user = request.user
+        annotated = getattr(recipe, 'is_favorited', None)
+        if annotated is not None:
+            return annotated
+        request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
-        return user.favorites.filter(recipe=recipe).exists()
+        return request.user.favorites.filter(recipe=recipe).exists()
 
     def get_is_in_shopping_cart(self, recipe):
         """Проверка на присутствие в корзине."""
-        request = self.context['request']
-        user = request.user
+        annotated = getattr(recipe, 'is_in_shopping_cart', None)
+        if annotated is not None:
+            return annotated
+        request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
-        return user.shopping_list.filter(recipe=recipe).exists()
+        return request.user.shopping_list.filter(recipe=recipe).exists()
+
+    def get_image_variants(self, recipe):
+        """Ссылки на уменьшенные копии изображения."""
+        return variant_urls(
+            recipe.image, RECIPE_IMAGE_VARIANTS, self.context.get('request'))
 
 
 class CreateRecipeIngredientsSerializer(serializers.ModelSerializer):
@@ -196,17 +229,24 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
 
         user = self.context['request'].user
         recipe = Recipe.objects.create(**validated_data, author=user)
+        change_counter(user, 'recipes_count', 1)
         self.create_ingredients(ingredients, recipe)
         self.create_tags(tags, recipe)
+        RecipeIngredientsChange.log((recipe.id,))
         return recipe
 
     @transaction.atomic
     def update(self, instance, validated_data):
-        """Обновление модели."""
-        instance.ingredients.clear()
+        """Обновление модели.
+
+        Разница старых и новых количеств переносится в суммы списков
+        покупок одним пакетом.
+        """
+        with ShoppingListItem.changing_recipes((instance.id,)):
+            instance.ingredients.clear()
+            self.create_ingredients(
+                validated_data.pop('ingredients'), instance)
         instance.tags.clear()
-
-        self.create_ingredients(validated_data.pop('ingredients'), instance)
         self.create_tags(validated_data.pop('tags'), instance)
         return super().update(instance, validated_data)
 
@@ -221,12 +261,29 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
         return serializer.data
 
 
+class RecipeByIngredientsSerializer(RecipeSerializer):
+    """Рецепт с числом найденных и недостающих ингредиентов."""
+
+    coverage = serializers.IntegerField(read_only=True)
+    missing = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('coverage', 'missing')
+
+
 class AnotherRecipeSerializer(serializers.ModelSerializer):
     """Дополнительный сериализатор рецептов."""
 
+    image_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
+
+    def get_image_variants(self, recipe):
+        """Ссылки на уменьшенные копии изображения."""
+        return variant_urls(
+            recipe.image, RECIPE_IMAGE_VARIANTS, self.context.get('request'))
 
 
 class FollowSerializer(serializers.ModelSerializer):
@@ -267,10 +324,7 @@ class FollowReadSerializer(UserSerializer):
 
     recipes = serializers.SerializerMethodField(
         method_name='get_recipes')
-    recipes_count = serializers.IntegerField(
-        source='recipes.count',
-        read_only=True
-    )
+    recipes_count = serializers.IntegerField(read_only=True)
     # avatar = serializers.ImageField(source='author.avatar', read_only=True)
 
     class Meta(UserSerializer.Meta):
@@ -281,12 +335,18 @@ class FollowReadSerializer(UserSerializer):
         )
 
     def get_recipes(self, obj):
-        """Получение рецептов."""
+        """Получение рецептов.
+
+        Если рецепты уже загружены вместе со страницей подписок
+        (атрибут limited_recipes), повторный запрос не выполняется.
+        """
         request = self.context.get('request')
-        recipes = obj.recipes.all()
-        recipes_limit = request.query_params.get('recipes_limit')
-        if recipes_limit:
-            recipes = recipes[:int(recipes_limit)]
+        recipes = getattr(obj, 'limited_recipes', None)
+        if recipes is None:
+            recipes = obj.recipes.all()
+            recipes_limit = request.query_params.get('recipes_limit')
+            if recipes_limit:
+                recipes = recipes[:int(recipes_limit)]
         return AnotherRecipeSerializer(recipes, context={
             'request': self.context['request']}, many=True).data
 
@@ -1,10 +1,13 @@
 import base64
+from tempfile import SpooledTemporaryFile
 
 import webcolors
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files import File
 from rest_framework import serializers
 
-from .constants import COLOR_HAVE_NO_NAME
+from .constants import COLOR_HAVE_NO_NAME, IMAGE_TOO_LARGE, INVALID_IMAGE_DATA
+from .metrics import UPLOAD_SIZE
 
 
 class Hex2NameColor(serializers.Field):
@@ -21,13 +24,45 @@ class Hex2NameColor(serializers.Field):
 
 
 class Base64ImageField(serializers.ImageField):
-    """Кодирование изображения."""
+    """Кодирование изображения.
+
+    Base64 декодируется частями во временный файл, который остается
+    в памяти только до FILE_UPLOAD_MAX_MEMORY_SIZE. Слишком большие
+    изображения отклоняются до декодирования.
+    """
+
+    # Кратно 4, чтобы каждая часть была целым блоком base64.
+    chunk_size = 64 * 1024
 
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
+            try:
+                format, imgstr = data.split(';base64,')
+            except ValueError:
+                raise serializers.ValidationError(INVALID_IMAGE_DATA)
             ext = format.split('/')[-1]
             file_name = f'temp.{ext}'
-            data = ContentFile(base64.b64decode(imgstr), name=file_name)
+            data = File(self.decode(imgstr), name=file_name)
 
         return super().to_internal_value(data)
+
+    def decode(self, imgstr):
+        # Переносы строк допустимы в base64, но мешают делить строку
+        # на целые блоки.
+        imgstr = ''.join(imgstr.split())
+        max_size = settings.MAX_IMAGE_UPLOAD_SIZE
+        if len(imgstr) // 4 * 3 > max_size:
+            raise serializers.ValidationError(
+                IMAGE_TOO_LARGE.format(max_size=max_size // 1024 // 1024))
+        file = SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        try:
+            for start in range(0, len(imgstr), self.chunk_size):
+                file.write(base64.b64decode(
+                    imgstr[start:start + self.chunk_size], validate=True))
+        except ValueError:
+            file.close()
+            raise serializers.ValidationError(INVALID_IMAGE_DATA)
+        UPLOAD_SIZE.observe(file.tell())
+        file.seek(0)
+        return file
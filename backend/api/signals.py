@@ -0,0 +1,72 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from recipes.models import Ingredient, Recipe, Tag, User, subtract_counts
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_tokens
+from .cache import bump_version
+from .images import AVATAR_VARIANTS, RECIPE_IMAGE_VARIANTS, schedule_variants
+from .indexes import ingredient_index
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredients(sender, **kwargs):
+    """Сброс индекса и кэша ингредиентов при их изменении."""
+    ingredient_index.invalidate()
+    bump_version('ingredients')
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tags(sender, **kwargs):
+    """Сброс кэша тегов при их изменении."""
+    bump_version('tags')
+
+
+@receiver(pre_delete, sender=User)
+def delete_user_recipes(sender, instance, **kwargs):
+    """Учет записей, удаляемых каскадно вместе с пользователем.
+
+    Сигналы отправляются до удаления строк, поэтому рецепты, избранное,
+    списки покупок и подписки еще доступны и учитываются одним пакетом:
+    суммы списков покупок и счетчики рецептов и авторов.
+    """
+    instance.recipes.all().prepare_delete()
+    subtract_counts(
+        Recipe, 'favorites_count', instance.favorites.all(), 'recipe')
+    subtract_counts(
+        Recipe, 'shopping_cart_count', instance.shopping_list.all(), 'recipe')
+    subtract_counts(
+        User, 'followers_count', instance.follower.all(), 'author')
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    """Сброс кэша удаленного токена, например при выходе."""
+    invalidate_tokens((instance.key,))
+
+
+def schedule_image_variants(instance, field, variants, update_fields):
+    """Создание копий изображения после фиксации транзакции."""
+    if update_fields is not None and field not in update_fields:
+        return
+    image = getattr(instance, field)
+    if image:
+        transaction.on_commit(
+            partial(schedule_variants, image.name, variants))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_variants(sender, instance, update_fields=None, **kwargs):
+    """Копии изображения рецепта."""
+    schedule_image_variants(
+        instance, 'image', RECIPE_IMAGE_VARIANTS, update_fields)
+
+
+@receiver(post_save, sender=User)
+def avatar_variants(sender, instance, update_fields=None, **kwargs):
+    """Копии аватара пользователя."""
+    schedule_image_variants(
+        instance, 'avatar', AVATAR_VARIANTS, update_fields)
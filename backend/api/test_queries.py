@@ -0,0 +1,309 @@
+#!-*-coding:utf-8-*-
+import csv
+from contextlib import contextmanager
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from recipes.models import (Favorite, Follow, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingList, ShoppingListItem,
+                            Tag, User)
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from .cache import bump_version
+from .filters import RECIPE_ORDERINGS
+
+AUTHORS_COUNT = 20
+RECIPES_PER_AUTHOR = 15
+INGREDIENTS_PER_RECIPE = 8
+FOLLOWED_AUTHORS_COUNT = 10
+FAVORITES_COUNT = 60
+SHOPPING_LIST_COUNT = 60
+
+
+def read_ingredients():
+    """Ингредиенты из data/ingredients.csv или синтетический набор."""
+    path = settings.DATA_DIR / 'ingredients.csv'
+    if not path.exists():
+        return [
+            Ingredient(name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(2000)
+        ]
+    with open(path, newline='', encoding='utf-8') as csvfile:
+        return [
+            Ingredient(name=name, measurement_unit=measurement_unit)
+            for name, measurement_unit in csv.reader(csvfile)
+        ]
+
+
+class QueryCountTestCase(APITestCase):
+    """Ограничения на число SQL-запросов для эндпоинтов API."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='vi', email='v@v.ru')
+        cls.token = Token.objects.create(user=cls.user)
+
+        cls.tags = [
+            Tag.objects.create(
+                name=name, color=color, slug=slug)
+            for name, color, slug in (
+                ('Завтрак', '#E26C2D', 'breakfast'),
+                ('Обед', '#49B64E', 'lunch'),
+                ('Ужин', '#8775D2', 'dinner'),
+            )
+        ]
+        Ingredient.objects.bulk_create(read_ingredients())
+        bump_version('ingredients')
+        ingredients = list(Ingredient.objects.all())
+
+        User.objects.bulk_create(
+            User(username=f'author{number}', email=f'a{number}@a.ru')
+            for number in range(AUTHORS_COUNT)
+        )
+        cls.authors = list(User.objects.exclude(id=cls.user.id))
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=author, name=f'Рецепт {number}', text='Описание',
+                cooking_time=number + 1, image='recipes/images/1.png')
+            for author in cls.authors
+            for number in range(RECIPES_PER_AUTHOR)
+        )
+        recipes = list(Recipe.objects.all())
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe.id, tag_id=tag.id)
+            for index, recipe in enumerate(recipes)
+            for tag in cls.tags[:index % len(cls.tags) + 1]
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient=ingredients[
+                    (index * INGREDIENTS_PER_RECIPE + offset)
+                    % len(ingredients)],
+                amount=offset + 1)
+            for index, recipe in enumerate(recipes)
+            for offset in range(INGREDIENTS_PER_RECIPE)
+        )
+        Follow.objects.bulk_create(
+            Follow(user=cls.user, author=author)
+            for author in cls.authors[:FOLLOWED_AUTHORS_COUNT]
+        )
+        Favorite.objects.bulk_create(
+            Favorite(user=cls.user, recipe=recipe)
+            for recipe in recipes[:FAVORITES_COUNT]
+        )
+        ShoppingList.objects.bulk_create(
+            ShoppingList(user=cls.user, recipe=recipe)
+            for recipe in recipes[:SHOPPING_LIST_COUNT]
+        )
+        ShoppingListItem.rebuild()
+        call_command('recount', stdout=StringIO())
+        cls.recipe = recipes[-1]
+        cls.cart_recipe = recipes[0]
+        cls.ingredient = ingredients[0]
+        cls.ingredients = ingredients
+
+    def setUp(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    @contextmanager
+    def assertMaxQueries(self, limit):
+        """Проверка, что выполнено не больше limit запросов."""
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        executed = len(context.captured_queries)
+        self.assertLessEqual(
+            executed, limit,
+            '{} queries executed, at most {} expected:\n{}'.format(
+                executed, limit, '\n'.join(
+                    query['sql'] for query in context.captured_queries)
+            )
+        )
+
+    def get(self, url, limit, data=None):
+        with self.assertMaxQueries(limit):
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_tags(self):
+        self.get(reverse('api:tags-list'), 2)
+        self.get(reverse('api:tags-list'), 1)
+        self.get(
+            reverse('api:tags-detail', kwargs={'pk': self.tags[0].id}), 2)
+
+    def test_ingredients(self):
+        self.get(reverse('api:ingredients-list'), 2)
+        response = self.get(
+            reverse('api:ingredients-list'), 1, {'name': 'Аб', 'limit': 3})
+        self.assertEqual(len(response.data), 3)
+        for ingredient in response.data:
+            self.assertTrue(ingredient['name'].lower().startswith('аб'))
+        self.get(
+            reverse('api:ingredients-detail',
+                    kwargs={'pk': self.ingredient.id}),
+            2
+        )
+
+    def test_recipe_list(self):
+        url = reverse('api:recipes-list')
+        self.get(url, 6)
+        self.get(url, 6, {'page': 10})
+        self.get(url, 7, {'tags': ('breakfast', 'lunch', 'dinner')})
+        self.get(url, 7, {'author': self.authors[0].id})
+        self.get(url, 6, {'is_favorited': 1})
+        self.get(url, 6, {'is_in_shopping_cart': 1})
+
+    def test_recipe_list_tags(self):
+        url = reverse('api:recipes-list')
+        self.get(url, 7, {'tags': 'breakfast'})
+        for tags in (('lunch',), ('breakfast', 'lunch', 'dinner')):
+            with self.assertMaxQueries(6) as context:
+                response = self.client.get(url, {'tags': tags, 'limit': 6})
+            for query in context.captured_queries:
+                self.assertNotIn('DISTINCT', query['sql'])
+            self.assertEqual(
+                response.data['count'],
+                Recipe.objects.filter(tags__slug__in=tags).distinct().count()
+            )
+            ids = [recipe['id'] for recipe in response.data['results']]
+            self.assertEqual(len(ids), len(set(ids)))
+        response = self.client.get(url, {'tags': ('lunch', 'unknown')})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(response.data['tags']), 1)
+        self.assertIn('unknown', response.data['tags'][0])
+
+    def test_recipe_list_cursor(self):
+        url = reverse('api:recipes-list')
+        for ordering, fields in RECIPE_ORDERINGS.items():
+            self.assertEqual(
+                self.walk_cursor(
+                    url, 6, {'ordering': ordering, 'limit': 40}),
+                list(Recipe.objects.order_by(
+                    *fields).values_list('id', flat=True))
+            )
+
+    def test_recipe_list_invalid_cursor(self):
+        response = self.client.get(
+            reverse('api:recipes-list'),
+            {'pagination': 'cursor', 'cursor': 'invalid'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def walk_cursor(self, url, limit, data):
+        """Обход всех страниц курсора, возвращает id записей."""
+        ids = []
+        data = dict(data, pagination='cursor')
+        while url:
+            with self.assertMaxQueries(limit) as context:
+                response = self.client.get(url, data)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            for query in context.captured_queries:
+                self.assertNotIn('COUNT(', query['sql'])
+                self.assertNotIn('OFFSET', query['sql'])
+            ids += [item['id'] for item in response.data['results']]
+            url, data = response.data['next'], None
+        return ids
+
+    def test_users_cursor(self):
+        self.assertEqual(
+            self.walk_cursor(reverse('api:users-list'), 4, {'limit': 7}),
+            list(User.objects.order_by('id').values_list('id', flat=True))
+        )
+        self.assertEqual(
+            self.walk_cursor(
+                reverse('api:users-subscriptions'), 5,
+                {'limit': 3, 'recipes_limit': 2}),
+            list(self.user.follower.order_by(
+                '-pub_date', '-id').values_list('author_id', flat=True))
+        )
+
+    def test_recipe_list_anonymous(self):
+        self.client.credentials()
+        self.get(reverse('api:recipes-list'), 4)
+
+    def test_recipe_detail(self):
+        self.get(
+            reverse('api:recipes-detail', kwargs={'pk': self.recipe.id}), 5)
+
+    def test_favorite(self):
+        url = reverse('api:recipes-favorite', kwargs={'pk': self.recipe.id})
+        with self.assertMaxQueries(9):
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        with self.assertMaxQueries(6):
+            response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_shopping_cart(self):
+        url = reverse(
+            'api:recipes-shopping_cart', kwargs={'pk': self.recipe.id})
+        with self.assertMaxQueries(13):
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        with self.assertMaxQueries(10):
+            response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_recipe_update_and_delete(self):
+        self.client.force_authenticate(self.cart_recipe.author)
+        url = reverse(
+            'api:recipes-detail', kwargs={'pk': self.cart_recipe.id})
+        with self.assertMaxQueries(38):
+            response = self.client.patch(url, {
+                'ingredients': [
+                    {'id': ingredient.id, 'amount': number + 1}
+                    for number, ingredient in enumerate(
+                        self.ingredients[-15:])
+                ],
+                'tags': [self.tags[0].id],
+                'name': 'Новое название', 'text': 'Описание',
+                'cooking_time': 10,
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertMaxQueries(18):
+            response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_download_shopping_cart(self):
+        self.get(reverse('api:recipes-download_shopping_cart'), 2)
+
+    def test_users(self):
+        self.get(reverse('api:users-list'), 4)
+        self.get(reverse('api:users-list'), 4, {'limit': 6, 'offset': 12})
+        self.get(
+            reverse('api:users-detail', kwargs={'pk': self.authors[0].id}),
+            3
+        )
+        self.get(reverse('api:users-me'), 2)
+
+    def test_is_subscribed(self):
+        followed = set(self.user.follower.values_list('author_id', flat=True))
+        response = self.get(
+            reverse('api:users-list'), 4, {'limit': AUTHORS_COUNT + 1})
+        self.assertEqual(len(response.data['results']), AUTHORS_COUNT + 1)
+        for user in response.data['results']:
+            self.assertEqual(user['is_subscribed'], user['id'] in followed)
+        response = self.get(
+            reverse('api:recipes-list'), 6,
+            {'pagination': 'cursor', 'limit': 100, 'ordering': 'cooking_time'})
+        self.assertEqual(
+            {recipe['author']['id'] for recipe in response.data['results']},
+            {author.id for author in self.authors}
+        )
+        for recipe in response.data['results']:
+            self.assertEqual(
+                recipe['author']['is_subscribed'],
+                recipe['author']['id'] in followed
+            )
+
+    def test_subscriptions(self):
+        url = reverse('api:users-subscriptions')
+        self.get(url, 5)
+        self.get(url, 5, {'recipes_limit': 3})
@@ -1,9 +1,31 @@
 #!-*-coding:utf-8-*-
+import base64
+import json
+import tempfile
+import time
+from io import BytesIO, StringIO
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from recipes.models import Follow, User
-from rest_framework import status
+from PIL import Image
+from recipes.models import (Favorite, Follow, Ingredient, Recipe,
+                            RecipeIngredient, RecipeIngredientsChange,
+                            ShoppingList, ShoppingListItem, Tag, User)
+from rest_framework import serializers, status
 from rest_framework.authtoken.models import Token
-from rest_framework.test import APITransactionTestCase
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from .cache import bump_version
+from .images import RECIPE_IMAGE_VARIANTS, variant_name, variant_urls
+from .indexes import RecipeIngredientIndex, recipe_ingredient_index
+from .serializers_fields import Base64ImageField
 
 
 class SubscribeUserTestCase(APITransactionTestCase):
@@ -41,3 +63,825 @@ class SubscribeUserTestCase(APITransactionTestCase):
 
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         print(resp.data)
+
+    def test_subscribe_list_recipes_limit(self):
+        url = reverse('api:users-subscriptions')
+        for number in range(3):
+            author = User.objects.create_user(
+                username=f'author{number}', email=f'a{number}@a.ru')
+            Follow.objects.create(user=self.user, author=author)
+            for recipe_number in range(4):
+                Recipe.objects.create(
+                    author=author, name=f'recipe{recipe_number}',
+                    text='text', cooking_time=1, image='recipes/images/1.png')
+        call_command('recount', stdout=StringIO())
+
+        with self.assertNumQueries(5):
+            resp = self.client.get(url, {'recipes_limit': 2})
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        for author in resp.data['results']:
+            self.assertEqual(len(author['recipes']), 2)
+            self.assertEqual(author['recipes_count'], 4)
+            self.assertTrue(author['is_subscribed'])
+
+
+class RecipeListQueriesTestCase(APITransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='vi', email='v@v.ru')
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        tags = [
+            Tag.objects.create(
+                name=f'tag{number}', color=f'#00000{number}',
+                slug=f'tag{number}')
+            for number in range(2)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'ingredient{number}', measurement_unit='г')
+            for number in range(5)
+        ]
+        for number in range(8):
+            author = User.objects.create_user(
+                username=f'author{number}', email=f'a{number}@a.ru')
+            recipe = Recipe.objects.create(
+                author=author, name=f'recipe{number}', text='text',
+                cooking_time=1, image='recipes/images/1.png')
+            recipe.tags.set(tags)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe=recipe, ingredient=ingredient, amount=number + 1)
+                for ingredient in ingredients
+            )
+
+    def test_recipe_list_queries(self):
+        url = reverse('api:recipes-list')
+
+        with self.assertNumQueries(6):
+            resp = self.client.get(url)
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.data['results']), 6)
+        for recipe in resp.data['results']:
+            self.assertEqual(len(recipe['ingredients']), 5)
+            self.assertEqual(len(recipe['tags']), 2)
+
+
+class IngredientIndexTestCase(APITransactionTestCase):
+
+    def test_index_follows_ingredient_changes(self):
+        url = reverse('api:ingredients-list')
+        ingredient = Ingredient.objects.create(
+            name='Сахар', measurement_unit='г')
+
+        resp = self.client.get(url, {'name': 'сах'})
+        self.assertEqual([item['id'] for item in resp.data], [ingredient.id])
+
+        ingredient.name = 'Соль'
+        ingredient.save()
+        self.assertEqual(self.client.get(url, {'name': 'сах'}).data, [])
+
+        ingredient.delete()
+        self.assertEqual(self.client.get(url, {'name': 'со'}).data, [])
+
+    def test_fuzzy_search(self):
+        url = reverse('api:ingredients-list')
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('молоко', 'молоко сгущенное', 'мука', 'сахар',
+                         'помидоры', 'помидоры черри')
+        )
+
+        def search(name, **params):
+            resp = self.client.get(url, {'name': name, 'fuzzy': 1, **params})
+            return [item['name'] for item in resp.data]
+
+        self.assertEqual(search('малоко'), ['молоко'])
+        self.assertEqual(search('помидор', limit=1), ['помидоры'])
+        self.assertEqual(search('сахр'), ['сахар'])
+        self.assertEqual(search('xyz'), [])
+
+
+class ReferenceCacheTestCase(APITransactionTestCase):
+
+    def test_conditional_requests(self):
+        url = reverse('api:tags-list')
+        Tag.objects.create(name='Завтрак', color='#E26C2D', slug='breakfast')
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        etag = resp['ETag']
+
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Tag.objects.create(name='Обед', color='#49B64E', slug='lunch')
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp['ETag'], etag)
+        self.assertEqual(len(resp.data), 2)
+
+    def test_version(self):
+        url = reverse('api:tags-list')
+        cache.clear()
+        resp = self.client.get(url)
+        etag, last_modified = resp['ETag'], resp['Last-Modified']
+
+        cache.clear()
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp['Last-Modified'], last_modified)
+
+        with patch('api.cache.time.time', return_value=time.time()):
+            bump_version('tags')
+            resp = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            last_modified = resp['Last-Modified']
+            bump_version('tags')
+            resp = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_ingredient_list(self):
+        url = reverse('api:ingredients-list')
+        Ingredient.objects.create(name='сахар', measurement_unit='г')
+
+        resp = self.client.get(url, {'name': 'са'})
+        self.assertEqual(len(resp.data), 1)
+        etag = resp['ETag']
+        self.assertIn('Last-Modified', resp)
+
+        resp = self.client.get(url, {'name': 'са'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        with self.assertNumQueries(0):
+            resp = self.client.get(url, {'name': 'са'})
+        self.assertEqual(len(resp.data), 1)
+
+        Ingredient.objects.create(name='сало', measurement_unit='г')
+        resp = self.client.get(url, {'name': 'са'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.data), 2)
+
+
+class CountersTestCase(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='vi', email='v@v.ru')
+        cls.token = Token.objects.create(user=cls.user)
+        cls.author = User.objects.create_user(
+            username='author', email='a@a.ru')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='recipe', text='text', cooking_time=1,
+            image='recipes/images/1.png')
+        call_command('recount', stdout=StringIO())
+
+    def setUp(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def assertCounters(self, recipe_counters, author_counters):
+        self.recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(
+            (self.recipe.favorites_count, self.recipe.shopping_cart_count),
+            recipe_counters
+        )
+        self.assertEqual(
+            (self.author.recipes_count, self.author.followers_count),
+            author_counters
+        )
+
+    def test_actions_update_counters(self):
+        self.assertCounters((0, 0), (1, 0))
+        urls = (
+            reverse('api:recipes-favorite', kwargs={'pk': self.recipe.id}),
+            reverse('api:recipes-shopping_cart',
+                    kwargs={'pk': self.recipe.id}),
+            reverse('api:users-subscribe', kwargs={'pk': self.author.id}),
+        )
+        for url in urls:
+            self.client.post(url)
+        self.assertCounters((1, 1), (1, 1))
+
+        for url in urls:
+            self.client.delete(url)
+        self.assertCounters((0, 0), (1, 0))
+
+        token = Token.objects.create(user=self.author)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.client.delete(
+            reverse('api:recipes-detail', kwargs={'pk': self.recipe.id}))
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 0)
+
+    def test_cascades_update_counters(self):
+        follower = User.objects.create_user(
+            username='follower', email='f@f.ru')
+        client = self.client_class()
+        client.force_authenticate(follower)
+        client.post(
+            reverse('api:recipes-favorite', kwargs={'pk': self.recipe.id}))
+        client.post(reverse(
+            'api:recipes-shopping_cart', kwargs={'pk': self.recipe.id}))
+        client.post(
+            reverse('api:users-subscribe', kwargs={'pk': self.author.id}))
+        self.assertCounters((1, 1), (1, 1))
+        follower.delete()
+        self.assertCounters((0, 0), (1, 0))
+
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@a.ru', password='admin')
+        self.client.force_login(admin)
+        self.client.post(reverse('admin:recipes_favorite_add'), {
+            'user': self.user.id, 'recipe': self.recipe.id})
+        self.assertCounters((1, 0), (1, 0))
+        self.client.post(
+            reverse('admin:recipes_recipe_delete', args=(self.recipe.id,)),
+            {'post': 'yes'})
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 0)
+
+    def test_recount(self):
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        Follow.objects.create(user=self.user, author=self.author)
+        User.objects.filter(pk=self.author.pk).update(recipes_count=5)
+
+        out = StringIO()
+        call_command('recount', stdout=out)
+
+        self.assertCounters((1, 0), (1, 1))
+        self.assertIn('recipe.favorites_count: исправлено 1', out.getvalue())
+
+
+class RecipeSearchTestCase(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(username='author', email='a@a.ru')
+        cls.recipes = {
+            name: Recipe.objects.create(
+                author=author, name=name, text=text, cooking_time=1,
+                image='recipes/images/1.png')
+            for name, text in (
+                ('Борщ', 'Свекла, капуста и картофель'),
+                ('Щи', 'Капуста и картофель, подавать как борщ'),
+                ('Омлет', 'Яйца и молоко'),
+            )
+        }
+
+    def search(self, query, **params):
+        resp = self.client.get(
+            reverse('api:recipes-list'), {'search': query, **params})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        return [recipe['name'] for recipe in resp.data['results']]
+
+    def test_ranked_by_name_then_text(self):
+        self.assertEqual(self.search('борщ'), ['Борщ', 'Щи'])
+        self.assertEqual(self.search('капуста картофель'), ['Борщ', 'Щи'])
+        self.assertEqual(self.search('пицца'), [])
+
+    def test_index_follows_changes(self):
+        recipe = self.recipes['Омлет']
+        recipe.name = 'Пицца'
+        recipe.save()
+        self.assertEqual(self.search('пицца'), ['Пицца'])
+        self.assertEqual(self.search('омлет'), [])
+
+        recipe.delete()
+        self.assertEqual(self.search('пицца'), [])
+
+    def test_cursor_and_ordering(self):
+        resp = self.client.get(reverse('api:recipes-list'), {
+            'search': 'картофель', 'pagination': 'cursor', 'limit': 1})
+        self.assertEqual(resp.data['results'][0]['name'], 'Борщ')
+        resp = self.client.get(resp.data['next'])
+        self.assertEqual(resp.data['results'][0]['name'], 'Щи')
+        self.assertIsNone(resp.data['next'])
+
+        self.assertEqual(
+            self.search('картофель', ordering='new'), ['Щи', 'Борщ'])
+
+
+class RecipeByIngredientsTestCase(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='a@a.ru')
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'ingredient{number}', measurement_unit='г')
+            for number in range(4)
+        ]
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.author, name=f'recipe{number}', text='text',
+                cooking_time=1, image='recipes/images/1.png')
+            for number in range(3)
+        ]
+        for recipe, ingredients in zip(
+                cls.recipes, ((0, 1), (0, 1, 2), (3,))):
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe=recipe, ingredient=cls.ingredients[index],
+                    amount=1)
+                for index in ingredients
+            )
+
+    def setUp(self):
+        recipe_ingredient_index.invalidate()
+
+    def search(self, *indexes):
+        resp = self.client.get(
+            reverse('api:recipes-by-ingredients'),
+            {'ids': ','.join(
+                str(self.ingredients[index].id) for index in indexes)}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        return [
+            (recipe['name'], recipe['coverage'], recipe['missing'])
+            for recipe in resp.data['results']
+        ]
+
+    def test_ranking(self):
+        self.assertEqual(
+            self.search(0, 1),
+            [('recipe0', 2, 0), ('recipe1', 2, 1)]
+        )
+        self.assertEqual(
+            self.search(2, 3),
+            [('recipe2', 1, 0), ('recipe1', 1, 2)]
+        )
+        self.assertEqual(self.search(), [])
+
+        resp = self.client.get(
+            reverse('api:recipes-by-ingredients'), {'ids': 'a,b'})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_index_follows_recipe_changes(self):
+        self.assertEqual(len(self.search(3)), 1)
+        other_process = RecipeIngredientIndex()
+        state = other_process.get_state()
+        recipe = self.recipes[0]
+        with ShoppingListItem.changing_recipes((recipe.id,)):
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=self.ingredients[3], amount=1)
+        self.assertEqual(
+            self.search(3), [('recipe2', 1, 0), ('recipe0', 1, 2)])
+        self.assertEqual(
+            other_process.search((self.ingredients[3].id,)),
+            (2, [(self.recipes[2].id, 1, 0), (recipe.id, 1, 2)]))
+        self.assertIs(other_process.get_state(), state)
+
+        token = Token.objects.create(user=self.author)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.client.delete(
+            reverse('api:recipes-detail', kwargs={'pk': recipe.id}))
+        self.assertEqual(self.search(3), [('recipe2', 1, 0)])
+        self.assertEqual(
+            other_process.search((self.ingredients[3].id,)),
+            (1, [(self.recipes[2].id, 1, 0)]))
+
+    def test_change_logged_once(self):
+        recipe = self.recipes[1]
+        url = reverse('api:recipes-detail', kwargs={'pk': recipe.id})
+        self.client.force_authenticate(self.author)
+        changes = RecipeIngredientsChange.objects.filter(recipe_id=recipe.id)
+
+        resp = self.client.patch(url, {
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 2}
+                for ingredient in self.ingredients
+            ],
+            'tags': [], 'name': recipe.name, 'text': 'text',
+            'cooking_time': 1,
+        }, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(changes.count(), 1)
+
+        self.client.delete(url)
+        self.assertEqual(changes.count(), 2)
+
+    def test_page(self):
+        ids = [ingredient.id for ingredient in self.ingredients]
+        self.assertEqual(
+            recipe_ingredient_index.search(ids, offset=1, limit=1),
+            (3, [(self.recipes[0].id, 2, 0)]))
+        with patch.object(PageNumberPagination, 'page_size', 2):
+            resp = self.client.get(
+                reverse('api:recipes-by-ingredients'),
+                {'ids': ','.join(map(str, ids)), 'page': 2})
+        self.assertEqual(resp.data['count'], 3)
+        self.assertEqual(
+            [recipe['name'] for recipe in resp.data['results']], ['recipe2'])
+
+
+class ShoppingListIngredientsTestCase(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='vi', email='v@v.ru')
+        cls.token = Token.objects.create(user=cls.user)
+        author = User.objects.create_user(username='author', email='a@a.ru')
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'ingredient{number}', measurement_unit='г')
+            for number in range(10)
+        ]
+        Recipe.objects.bulk_create(
+            Recipe(author=author, name=f'recipe{number}', text='text',
+                   cooking_time=1, image='recipes/images/1.png')
+            for number in range(300)
+        )
+        recipes = list(Recipe.objects.all())
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe, ingredient=ingredient,
+                amount=index % 7 + number + 1)
+            for index, recipe in enumerate(recipes)
+            for number, ingredient in enumerate(ingredients)
+            if (index + number) % 3
+        )
+        ShoppingList.objects.bulk_create(
+            ShoppingList(user=cls.user, recipe=recipe)
+            for recipe in recipes[:250]
+        )
+        ShoppingListItem.rebuild()
+        call_command('recount', stdout=StringIO())
+
+    def test_totals(self):
+        expected = {}
+        for recipe_ingredient in RecipeIngredient.objects.filter(
+                recipe__shopping_list__user=self.user):
+            expected[recipe_ingredient.ingredient_id] = (
+                expected.get(recipe_ingredient.ingredient_id, 0)
+                + recipe_ingredient.amount)
+
+        with self.assertNumQueries(1):
+            ingredients = list(ShoppingListItem.get_ingredients(self.user))
+
+        self.assertEqual(
+            {item['ingredient']: item['total'] for item in ingredients},
+            expected
+        )
+
+    def test_download(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        url = reverse('api:recipes-download_shopping_cart')
+
+        resp = self.client.get(url)
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        lines = b''.join(resp.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 11)
+        self.assertEqual(lines[0], 'Список покупок:')
+
+    def test_download_formats(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        url = reverse('api:recipes-download_shopping_cart')
+        expected = list(ShoppingListItem.get_ingredients(self.user))
+
+        resp = self.client.get(url, {'format': 'csv'})
+        self.assertEqual(resp['Content-Type'], 'text/csv; charset=utf-8')
+        rows = b''.join(resp.streaming_content).decode().splitlines()
+        self.assertEqual(len(rows), len(expected) + 1)
+
+        resp = self.client.get(url, {'format': 'json'})
+        data = json.loads(b''.join(resp.streaming_content))
+        self.assertEqual(
+            [item['amount'] for item in data],
+            [item['total'] for item in expected]
+        )
+
+    def test_download_empty(self):
+        ShoppingList.objects.all().delete()
+        ShoppingListItem.rebuild()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        url = reverse('api:recipes-download_shopping_cart')
+
+        resp = self.client.get(url, {'format': 'json'})
+
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('error', json.loads(resp.content))
+
+    def assertItemsConsistent(self):
+        self.assertEqual(
+            {
+                (item['user'], item['ingredient']): item['total']
+                for item in ShoppingListItem.calculate()
+            },
+            {
+                (item.user_id, item.ingredient_id): item.total_amount
+                for item in ShoppingListItem.objects.all()
+            }
+        )
+
+    def test_items_follow_changes(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        recipe = Recipe.objects.exclude(shopping_list__user=self.user).first()
+        url = reverse('api:recipes-shopping_cart', kwargs={'pk': recipe.id})
+
+        self.client.post(url)
+        self.assertItemsConsistent()
+
+        other_user = User.objects.create_user(
+            username='other', email='o@o.ru')
+        other_client = self.client_class()
+        other_client.force_authenticate(other_user)
+        other_client.post(url)
+        ingredient = Ingredient.objects.create(
+            name='new ingredient', measurement_unit='шт')
+        author_client = self.client_class()
+        author_client.force_authenticate(recipe.author)
+        resp = author_client.patch(
+            reverse('api:recipes-detail', kwargs={'pk': recipe.id}),
+            {
+                'ingredients': [
+                    {'id': recipe.ingredients.first().id, 'amount': 100},
+                    {'id': ingredient.id, 'amount': 3},
+                ],
+                'tags': [],
+                'name': recipe.name, 'text': 'text', 'cooking_time': 1,
+            },
+            format='json'
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertItemsConsistent()
+
+        self.client.delete(url)
+        self.assertItemsConsistent()
+
+        author_client.delete(
+            reverse('api:recipes-detail', kwargs={'pk': recipe.id}))
+        self.assertItemsConsistent()
+
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@a.ru', password='admin')
+        self.client.force_login(admin)
+        recipe_ingredient = RecipeIngredient.objects.filter(
+            recipe__shopping_list__user=self.user).first()
+        resp = self.client.post(
+            reverse('admin:recipes_recipeingredient_change',
+                    args=(recipe_ingredient.id,)),
+            {
+                'ingredient': recipe_ingredient.ingredient_id,
+                'recipe': recipe_ingredient.recipe_id,
+                'amount': recipe_ingredient.amount + 10,
+            }
+        )
+        self.assertEqual(resp.status_code, status.HTTP_302_FOUND)
+        self.assertItemsConsistent()
+
+        author = User.objects.get(username='author')
+        with CaptureQueriesContext(connection) as context:
+            author.delete()
+        self.assertLessEqual(len(context.captured_queries), 26)
+        self.assertFalse(ShoppingList.objects.filter(
+            recipe__author_id=author.id).exists())
+        self.assertItemsConsistent()
+
+
+class ImportCSVTestCase(APITestCase):
+
+    def import_csv(self, path):
+        stdout, stderr = StringIO(), StringIO()
+        call_command(
+            'import_csv', path, 'recipes', 'Ingredient', '--batch-size', '2',
+            stdout=stdout, stderr=stderr)
+        return stdout.getvalue()
+
+    def test_import(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = f'{directory.name}/ingredients.csv'
+        with open(path, 'w', encoding='utf-8') as csvfile:
+            csvfile.write(
+                'соль,г\n'
+                'сахар,г\n'
+                'соль,г\n'
+                'молоко\n'
+                ',мл\n'
+                'яйца,шт\n'
+            )
+
+        output = self.import_csv(path)
+        self.assertIn('добавлено 3, пропущено 1, ошибок 2', output)
+        self.assertEqual(
+            set(Ingredient.objects.values_list('name', 'measurement_unit')),
+            {('соль', 'г'), ('сахар', 'г'), ('яйца', 'шт')}
+        )
+
+        output = self.import_csv(path)
+        self.assertIn('добавлено 0, пропущено 4, ошибок 2', output)
+        self.assertEqual(Ingredient.objects.count(), 3)
+
+
+def image_data(size=(800, 600)):
+    buffer = BytesIO()
+    Image.new('RGB', size, 'red').save(buffer, 'PNG')
+    return ('data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
+
+
+class ImageVariantsTestCase(APITestCase):
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+
+    def test_base64_decode(self):
+        field = Base64ImageField()
+        image = field.to_internal_value(image_data())
+        self.assertEqual(image.image.size, (800, 600))
+        header, encoded = image_data().split(',')
+        wrapped = '\n'.join(
+            encoded[start:start + 76] for start in range(0, len(encoded), 76))
+        image = field.to_internal_value(f'{header},{wrapped}')
+        self.assertEqual(image.image.size, (800, 600))
+        with self.assertRaises(serializers.ValidationError):
+            field.to_internal_value('data:image/png;base64,не base64')
+        with override_settings(MAX_IMAGE_UPLOAD_SIZE=1024):
+            with self.assertRaises(serializers.ValidationError):
+                field.to_internal_value(image_data())
+
+    def test_generate_variants(self):
+        author = User.objects.create_user(username='author', email='a@a.ru')
+        recipe = Recipe(
+            author=author, name='recipe', text='text', cooking_time=1)
+        recipe.image = Base64ImageField().to_internal_value(image_data())
+        recipe.save()
+        self.assertEqual(
+            variant_urls(recipe.image, RECIPE_IMAGE_VARIANTS), {})
+
+        call_command('generate_image_variants', stdout=StringIO())
+        with patch.object(recipe.image.storage, 'exists') as exists:
+            urls = variant_urls(recipe.image, RECIPE_IMAGE_VARIANTS)
+        exists.assert_not_called()
+        self.assertEqual(set(urls), set(RECIPE_IMAGE_VARIANTS))
+        with default_storage.open(
+                variant_name(recipe.image.name, 'card')) as file:
+            self.assertEqual(max(Image.open(file).size), 480)
+
+        resp = self.client.get(
+            reverse('api:recipes-detail', kwargs={'pk': recipe.id}))
+        self.assertEqual(
+            set(resp.data['image_variants']), set(RECIPE_IMAGE_VARIANTS))
+
+    def test_hashed_storage(self):
+        first, second = (
+            User.objects.create_user(username=name, email=f'{name}@a.ru')
+            for name in ('first', 'second'))
+        url = reverse('api:users-me/avatar')
+        for user in (first, second):
+            self.client.force_authenticate(user)
+            resp = self.client.put(
+                url, {'avatar': image_data()}, format='json')
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.avatar.name, second.avatar.name)
+        name = first.avatar.name
+        self.assertRegex(
+            name, r'^users/\w\w/\w\w/\w{64}\.png$')
+
+        self.client.delete(url)
+        self.assertTrue(default_storage.exists(name))
+        call_command('collect_media', min_age=0, stdout=StringIO())
+        self.assertTrue(default_storage.exists(name))
+
+        self.client.force_authenticate(first)
+        self.client.delete(url)
+        call_command('collect_media', min_age=0, stdout=StringIO())
+        self.assertFalse(default_storage.exists(name))
+
+
+@override_settings(REQUEST_TIMING=True)
+class RequestTimingTestCase(APITestCase):
+
+    def test_server_timing(self):
+        with self.assertLogs('api.requests', 'INFO') as logs:
+            resp = self.client.get(reverse('api:recipes-list'))
+        self.assertRegex(
+            resp['Server-Timing'],
+            r'^db;dur=[\d.]+;desc="\d+ queries", view;dur=[\d.]+, '
+            r'serialize;dur=[\d.]+, render;dur=[\d.]+, total;dur=[\d.]+$')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'api:recipes-list')
+        self.assertIn('serialize_ms', record)
+        self.assertEqual(record['status'], status.HTTP_200_OK)
+
+    @override_settings(REQUEST_QUERY_BUDGET=0)
+    def test_query_budget(self):
+        user = User.objects.create_user(username='user', email='u@u.ru')
+        self.client.force_authenticate(user)
+        with self.assertLogs('api.requests', 'WARNING') as logs:
+            self.client.get(reverse('api:recipes-list'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertTrue(record['over_budget'])
+        self.assertGreater(record['queries'], 0)
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsTestCase(APITestCase):
+
+    def test_access(self):
+        url = reverse('api:metrics')
+        self.assertEqual(
+            self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        resp = self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(resp.status_code, status.HTTP_403_FORBIDDEN)
+        admin = User.objects.create_user(
+            username='admin', email='a@a.ru', is_staff=True)
+        self.client.force_authenticate(admin)
+        self.assertEqual(
+            self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(
+                self.client.get(
+                    url, HTTP_AUTHORIZATION='Bearer ').status_code,
+                status.HTTP_403_FORBIDDEN)
+
+    def test_metrics(self):
+        self.client.get(reverse('api:tags-list'))
+        self.client.get(reverse('api:tags-list'))
+        resp = self.client.get(
+            reverse('api:metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        content = resp.content.decode()
+        self.assertIn(
+            'api_requests_total{method="GET",status="200",'
+            'view="TagViewSet.list"}', content)
+        self.assertIn(
+            'api_db_queries_bucket{le="1.0",view="TagViewSet.list"}',
+            content)
+        self.assertIn(
+            'api_cache_requests_total{name="tags",result="hit"}', content)
+
+
+class CachedTokenAuthenticationTestCase(APITestCase):
+
+    def setUp(self):
+        # Файловый кэш общий для процессов, как Redis или Memcached.
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        settings_override = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': cache_dir.name,
+        }})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(
+            username='user', email='u@u.ru', password='old-password-1')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.url = reverse('api:users-me')
+
+    def test_cached_user(self):
+        self.assertEqual(
+            self.client.get(self.url).status_code, status.HTTP_200_OK)
+        with CaptureQueriesContext(connection) as context:
+            resp = self.client.get(self.url)
+        self.assertEqual(resp.data['username'], 'user')
+        self.assertFalse(any(
+            'authtoken_token' in query['sql']
+            for query in context.captured_queries))
+
+    def test_logout(self):
+        self.client.get(self.url)
+        resp = self.client.post(reverse('api:logout'))
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(
+            self.client.get(self.url).status_code,
+            status.HTTP_401_UNAUTHORIZED)
+
+    def test_set_password(self):
+        resp = self.client.post(
+            reverse('api:users-set_password'),
+            {'current_password': 'old-password-1',
+             'new_password': 'new-password-2'})
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('new-password-2'))
+        self.assertEqual(self.user.recipes_count, 0)
+
+    def test_local_cache(self):
+        """С кэшем процесса токен, удаленный в другом процессе, не действует.
+
+        Другой процесс моделируется удалением токена без сброса
+        кэша в текущем процессе.
+        """
+        with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual(
+                self.client.get(self.url).status_code, status.HTTP_200_OK)
+            with patch('api.signals.invalidate_tokens'):
+                self.token.delete()
+            self.assertEqual(
+                self.client.get(self.url).status_code,
+                status.HTTP_401_UNAUTHORIZED)
@@ -1,7 +1,8 @@
 from django.urls import include, path
 from rest_framework import routers
 
-from .views import IngredientViewSet, RecipeViewSet, TagViewSet, UserViewSet
+from .views import (IngredientViewSet, RecipeViewSet, TagViewSet, UserViewSet,
+                    metrics)
 
 app_name = 'api'
 
@@ -13,6 +14,7 @@ router.register('users', UserViewSet, basename='users')
 
 
 urlpatterns = [
+    path('metrics', metrics, name='metrics'),
     path('', include(router.urls)),
     path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
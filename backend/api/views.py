@@ -1,57 +1,117 @@
 import os
-
-from django.db.models import Sum
-from django.http import HttpResponse
+from functools import partial
+from itertools import chain
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection, transaction
+from django.db.models import (BooleanField, Exists, OuterRef, Prefetch,
+                              Subquery, Value)
+from django.http import (HttpResponse, HttpResponseForbidden,
+                         StreamingHttpResponse)
 from django.shortcuts import get_object_or_404
+from django.utils.crypto import constant_time_compare
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.serializers import SetPasswordSerializer
-from recipes.models import Ingredient, Recipe, Tag, User
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingList, ShoppingListItem, Tag, User,
+                            change_counter)
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.exceptions import MethodNotAllowed, NotFound
-from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.exceptions import (MethodNotAllowed, NotFound,
+                                       ValidationError)
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 
-from .constants import (AMOUNT_KEY, HAVE_NO_AVATAR, METHOD_NOT_ALLOWED,
-                        NAME_KEY, NO_RECIPES_TO_GENERATE_SHOPPING_LIST,
-                        NOT_SUBSCRIBED, RECIPE_NOT_IN_FAVORITES,
-                        RECIPE_NOT_IN_SHOPPING_LIST,
+from .authentication import invalidate_user_tokens
+from .cache import CachedResponseMixin, get_version
+from .constants import (FUZZY_SEARCH_LIMIT, FUZZY_SIMILARITY_THRESHOLD,
+                        HAVE_NO_AVATAR, INVALID_INGREDIENT_IDS,
+                        MAX_FUZZY_SEARCH_LIMIT, METHOD_NOT_ALLOWED,
+                        NO_RECIPES_TO_GENERATE_SHOPPING_LIST, NOT_SUBSCRIBED,
+                        RECIPE_NOT_IN_FAVORITES, RECIPE_NOT_IN_SHOPPING_LIST,
+                        SHOPPING_LIST_CHUNK_SIZE,
                         SUCCESSFULLY_ADDED_TO_SHOPPING_LIST,
                         SUCCESSFULLY_DELETED_FAVORITE,
                         SUCCESSFULLY_DELETED_FROM_SHOPPING_LIST,
                         SUCCESSFULLY_DELETED_SUBSCRIPTION,
-                        SUCCESSFULLY_FAVORITED, TOTAL_KEY,
-                        UNEXPECTED_FORMAT_OF_DATA, UNIT_KEY)
-from .filters import IngredientFilter, RecipeFilter
+                        SUCCESSFULLY_FAVORITED)
+from .filters import RecipeFilter
+from .indexes import ingredient_index, recipe_ingredient_index
+from .metrics import latest_metrics
+from .pagination import PrecomputedPage, RecipePagination, UserPagination
 from .permissions import IsAdminAuthorOrReadOnly
+from .renderers import (ShoppingListCSVRenderer, ShoppingListJSONRenderer,
+                        ShoppingListTextRenderer)
 from .serializers import (CreateRecipeSerializer, CreateUserSerializer,
                           CurrentUserPhotoSerializer, FavoriteSerializer,
                           FollowSerializer, IngredientSerializer,
-                          RecipeSerializer, ShoppingListSerializer,
-                          TagSerializer, UserSerializer)
+                          RecipeByIngredientsSerializer, RecipeSerializer,
+                          ShoppingListSerializer, TagSerializer,
+                          UserSerializer)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     """Tag."""
 
+    cache_name = 'tags'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (AllowAny,)
     pagination_class = None
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     """Ingredient."""
 
+    cache_name = 'ingredients'
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny,)
     pagination_class = None
-    filter_backends = (DjangoFilterBackend,)
-    filterset_class = IngredientFilter
-    search_fields = ('^name',)
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            request, self.search, *args, **kwargs)
+
+    def search(self, request, *args, **kwargs):
+        """Поиск ингредиентов по началу названия.
+
+        Ответ строится по индексу в памяти процесса без обращения к БД.
+        Параметр limit ограничивает количество результатов.
+        С параметром fuzzy=1 выполняется нечеткий поиск по триграммам.
+        """
+        name = request.query_params.get('name', '')
+        limit = request.query_params.get('limit')
+        limit = int(limit) if limit and limit.isdigit() else None
+        if name and request.query_params.get('fuzzy') in ('1', 'true'):
+            ingredients = self.fuzzy_search(
+                name, min(limit or FUZZY_SEARCH_LIMIT, MAX_FUZZY_SEARCH_LIMIT))
+        else:
+            ingredients = ingredient_index.search(
+                name, limit, version=get_version(self.cache_name))
+        serializer = self.get_serializer(ingredients, many=True)
+        return Response(serializer.data)
+
+    def fuzzy_search(self, name, limit):
+        """Ингредиенты, похожие на name, по убыванию сходства.
+
+        В PostgreSQL поиск идет по индексу GIN pg_trgm, в остальных
+        базах — по триграммам индекса в памяти процесса.
+        """
+        if connection.vendor != 'postgresql':
+            return ingredient_index.fuzzy_search(
+                name, limit, FUZZY_SIMILARITY_THRESHOLD,
+                version=get_version(self.cache_name))
+        return Ingredient.objects.filter(
+            name__trigram_similar=name
+        ).annotate(
+            similarity=TrigramSimilarity('name', name)
+        ).order_by(
+            '-similarity', 'name'
+        ).values('id', 'name', 'measurement_unit')[:limit]
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -59,7 +119,7 @@ class UserViewSet(viewsets.ModelViewSet):
 
     queryset = User.objects.all()
     permission_classes = (AllowAny,)
-    pagination_class = LimitOffsetPagination
+    pagination_class = UserPagination
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -99,7 +159,10 @@ class UserViewSet(viewsets.ModelViewSet):
             )
         elif request.method == 'DELETE':
             if user.avatar:
-                user.avatar.delete()
+                # Файл может быть общим для нескольких пользователей,
+                # неиспользуемые файлы удаляет команда collect_media.
+                user.avatar = None
+                user.save(update_fields=('avatar',))
                 return Response(status=status.HTTP_204_NO_CONTENT)
             raise NotFound(HAVE_NO_AVATAR)
         raise MethodNotAllowed(request.method, detail=METHOD_NOT_ALLOWED)
@@ -120,6 +183,7 @@ class UserViewSet(viewsets.ModelViewSet):
         self.request.user.set_password(
             serializer.validated_data['new_password'])
         self.request.user.save()
+        invalidate_user_tokens(self.request.user)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -130,7 +194,22 @@ class UserViewSet(viewsets.ModelViewSet):
     )
     def subscriptions(self, request):
         """Создание страницы подписок."""
-        queryset = request.user.follower.all()
+        recipes = Recipe.objects.all()
+        recipes_limit = request.query_params.get('recipes_limit')
+        if recipes_limit:
+            recipes = recipes.filter(id__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('author')
+                ).values('id')[:int(recipes_limit)]
+            ))
+        queryset = request.user.follower.select_related(
+            'author'
+        ).order_by(
+            '-pub_date'
+        ).prefetch_related(
+            Prefetch('author__recipes', queryset=recipes,
+                     to_attr='limited_recipes')
+        )
         pages = self.paginate_queryset(queryset)
         context = self.get_serializer_context()
         serializer = FollowSerializer(pages, many=True, context=context)
@@ -156,11 +235,16 @@ class UserViewSet(viewsets.ModelViewSet):
                 context={'request': request}
             )
             serializer.is_valid(raise_exception=True)
-            serializer.save(user=self.request.user)
+            with transaction.atomic():
+                serializer.save(user=self.request.user)
+                change_counter(author, 'followers_count', 1)
             return Response(serializer.data,
                             status=status.HTTP_201_CREATED)
 
-        deleted, _ = user.follower.filter(author=author).delete()
+        with transaction.atomic():
+            deleted, _ = user.follower.filter(author=author).delete()
+            if deleted:
+                change_counter(author, 'followers_count', -1)
         if deleted:
             return Response(
                 SUCCESSFULLY_DELETED_SUBSCRIPTION.format(author=author),
@@ -175,12 +259,39 @@ class RecipeViewSet(ModelViewSet):
     queryset = Recipe.objects.all().select_related(
         'author'
     ).prefetch_related(
-        'ingredients', 'tags'
+        Prefetch(
+            'recipe_ingredients',
+            queryset=RecipeIngredient.objects.select_related('ingredient')
+        ),
+        'tags'
     )
     permission_classes = (IsAdminAuthorOrReadOnly,)
+    pagination_class = RecipePagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        """Рецепты с отметками избранного и списка покупок.
+
+        Флаги считаются подзапросами EXISTS в том же запросе,
+        что и страница рецептов.
+        """
+        if self.action in ('favorite', 'shopping_list'):
+            return Recipe.objects.all()
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField())
+            )
+        return queryset.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingList.objects.filter(
+                user=user, recipe=OuterRef('pk')))
+        )
+
     def get_serializer_class(self):
         """Вызов сериализатора."""
         if self.action in ('list', 'retrieve'):
@@ -188,6 +299,49 @@ class RecipeViewSet(ModelViewSet):
         elif self.action in ('create', 'partial_update'):
             return CreateRecipeSerializer
 
+    @action(
+        detail=False,
+        url_path='by-ingredients',
+        url_name='by-ingredients',
+        pagination_class=PageNumberPagination,
+    )
+    def by_ingredients(self, request):
+        """Рецепты из имеющихся ингредиентов ?ids=1,2,3.
+
+        Рецепты ищутся по обратному индексу в памяти процесса
+        и упорядочены по числу найденных ингредиентов, затем
+        по числу недостающих. Индекс отбирает только нужную
+        страницу, из базы загружаются только ее рецепты.
+        """
+        try:
+            ingredient_ids = [
+                int(value)
+                for values in request.query_params.getlist('ids')
+                for value in values.split(',') if value
+            ]
+        except ValueError:
+            raise ValidationError({'ids': INVALID_INGREDIENT_IDS})
+        page_size = self.paginator.get_page_size(request)
+        number = request.query_params.get(
+            self.paginator.page_query_param, '1')
+        offset = (int(number) - 1) * page_size if (
+            number.isdigit() and int(number) > 0) else 0
+        page = self.paginate_queryset(PrecomputedPage(
+            partial(recipe_ingredient_index.search, ingredient_ids),
+            offset, page_size))
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in page])
+        results = []
+        for recipe_id, coverage, missing in page:
+            recipe = recipes.get(recipe_id)
+            if recipe is not None:
+                recipe.coverage = coverage
+                recipe.missing = missing
+                results.append(recipe)
+        serializer = RecipeByIngredientsSerializer(
+            results, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
     @action(
         detail=True,
         methods=('post', 'delete'),
@@ -208,13 +362,18 @@ class RecipeViewSet(ModelViewSet):
                 context={'request': request}
             )
             serializer.is_valid(raise_exception=True)
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
+                change_counter(recipe, 'favorites_count', 1)
             return Response(
                 SUCCESSFULLY_FAVORITED.format(recipe=recipe),
                 status=status.HTTP_201_CREATED
             )
 
-        deleted, _ = user.favorites.filter(recipe=recipe).delete()
+        with transaction.atomic():
+            deleted, _ = user.favorites.filter(recipe=recipe).delete()
+            if deleted:
+                change_counter(recipe, 'favorites_count', -1)
         if deleted:
             return Response(
                 SUCCESSFULLY_DELETED_FAVORITE.format(recipe=recipe),
@@ -255,13 +414,20 @@ class RecipeViewSet(ModelViewSet):
                 context={'request': request}
             )
             serializer.is_valid(raise_exception=True)
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
+                ShoppingListItem.add_recipe((user.id,), recipe)
+                change_counter(recipe, 'shopping_cart_count', 1)
             return Response(
                 SUCCESSFULLY_ADDED_TO_SHOPPING_LIST.format(recipe=recipe),
                 status=status.HTTP_201_CREATED
             )
 
-        deleted, _ = user.shopping_list.filter(recipe=recipe).delete()
+        with transaction.atomic():
+            deleted, _ = user.shopping_list.filter(recipe=recipe).delete()
+            if deleted:
+                ShoppingListItem.remove_recipe((user.id,), recipe)
+                change_counter(recipe, 'shopping_cart_count', -1)
         if deleted:
             return Response(
                 SUCCESSFULLY_DELETED_FROM_SHOPPING_LIST.format(recipe=recipe),
@@ -270,49 +436,51 @@ class RecipeViewSet(ModelViewSet):
         return Response(
             RECIPE_NOT_IN_SHOPPING_LIST, status=status.HTTP_400_BAD_REQUEST)
 
-    @staticmethod
-    def get_shopping_list(ingredients):
-        """Создание списка для загрузки."""
-        shopping_list_header = ('Список покупок:\n',)
-
-        try:
-            shopping_list_body = (
-                "{} - {} ({})\n".format(
-                    ingredient.get(NAME_KEY, 'Не указано'),
-                    ingredient.get(TOTAL_KEY, 'Не указано'),
-                    ingredient.get(UNIT_KEY, 'Не указано')
-                )
-                for ingredient in ingredients
-            )
-        except (TypeError, AttributeError) as error:
-            raise ValueError(
-                UNEXPECTED_FORMAT_OF_DATA) from error
-
-        return ''.join((*shopping_list_header, *shopping_list_body))
-
     @action(
         detail=False,
         permission_classes=(IsAuthenticated,),
         url_path='download_shopping_cart',
         url_name='download_shopping_cart',
+        renderer_classes=(
+            ShoppingListTextRenderer,
+            ShoppingListCSVRenderer,
+            ShoppingListJSONRenderer,
+        ),
     )
     def download_shopping_list(self, request):
-        """Загрузка файла с ингредиентами."""
-        user = request.user
-        ingredients = user.shopping_list.values(
-            NAME_KEY,
-            UNIT_KEY,
-        ).annotate(
-            total=Sum(AMOUNT_KEY)
-        ).order_by(NAME_KEY)
-        if not ingredients.exists():
+        """Загрузка файла с ингредиентами.
+
+        Формат выбирается параметром format (txt, csv, json)
+        или заголовком Accept. Строки читаются из БД частями
+        и отдаются потоком.
+        """
+        ingredients = ShoppingListItem.get_ingredients(
+            request.user).iterator(chunk_size=SHOPPING_LIST_CHUNK_SIZE)
+        first = next(ingredients, None)
+        if first is None:
             return Response(
                 {"error": NO_RECIPES_TO_GENERATE_SHOPPING_LIST},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        shopping_list = self.get_shopping_list(ingredients)
-        response = HttpResponse(
-            shopping_list, content_type='text/plain; charset=UTF-8')
-        response['Content-Disposition'
-                 ] = 'attachment; filename="shopping_list.txt"'
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(chain((first,), ingredients)),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{renderer.format}"')
         return response
+
+
+def metrics(request):
+    """Метрики API для Prometheus.
+
+    Доступны только с заголовком Authorization: Bearer <METRICS_TOKEN>.
+    Если METRICS_TOKEN не задан, эндпоинт отключен.
+    """
+    token = settings.METRICS_TOKEN
+    if not token or not constant_time_compare(
+            request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+    content, content_type = latest_metrics()
+    return HttpResponse(content, content_type=content_type)
@@ -10,7 +10,20 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/wsgi/
 import os
 
 from django.core.wsgi import get_wsgi_application
+from django.db import DatabaseError
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram_backend.settings')
 
 application = get_wsgi_application()
+
+# Индексы строятся при старте воркера,
+# чтобы первые запросы поиска не ждали загрузки.
+from api.cache import get_version  # noqa: E402
+from api.indexes import ingredient_index  # noqa: E402
+from api.indexes import recipe_ingredient_index  # noqa: E402
+
+try:
+    ingredient_index.build(get_version('ingredients'))
+    recipe_ingredient_index.get_state()
+except DatabaseError:
+    pass
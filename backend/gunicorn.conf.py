@@ -0,0 +1,23 @@
+import os
+import shutil
+
+from prometheus_client import multiprocess
+
+# Метрики всех процессов gunicorn для /api/metrics. Переменная задается
+# только для gunicorn: prometheus_client открывает файлы в этом каталоге
+# уже при импорте api.metrics, а каталог создает on_starting, поэтому
+# manage.py работает с метриками в памяти процесса.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus')
+
+
+def on_starting(server):
+    """Удаление метрик процессов прошлого запуска."""
+    path = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+
+def child_exit(server, worker):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(worker.pid)
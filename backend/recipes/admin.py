@@ -1,7 +1,49 @@
 from django.contrib.admin import ModelAdmin, TabularInline, register
 
 from .models import (Favorite, Follow, Ingredient, Recipe, RecipeIngredient,
-                     ShoppingList, Tag, User)
+                     ShoppingList, ShoppingListItem, Tag, User, change_counter,
+                     subtract_counts)
+from .search import search_recipes
+
+
+def move_counter(target, field, previous_id):
+    """Счетчик field записи target после изменения внешнего ключа.
+
+    previous_id — прежнее значение ключа, None для новой записи.
+    """
+    if previous_id == target.pk:
+        return
+    if previous_id is not None:
+        change_counter(type(target)(pk=previous_id), field, -1)
+    change_counter(target, field, 1)
+
+
+class CounterAdminMixin:
+    """Счетчик связанной записи при изменениях в админке.
+
+    counter_target — внешний ключ на запись со счетчиком,
+    counter_field — поле счетчика.
+    """
+
+    counter_target = None
+    counter_field = None
+
+    def save_model(self, request, obj, form, change):
+        previous_id = form.initial.get(self.counter_target) if change else None
+        super().save_model(request, obj, form, change)
+        move_counter(
+            getattr(obj, self.counter_target), self.counter_field,
+            previous_id)
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, self.model.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        target = self.model._meta.get_field(self.counter_target)
+        subtract_counts(
+            target.related_model, self.counter_field, queryset,
+            self.counter_target)
+        super().delete_queryset(request, queryset)
 
 
 class RecipeIngredientInLine(TabularInline):
@@ -11,7 +53,8 @@ class RecipeIngredientInLine(TabularInline):
 
 @register(User)
 class UserAdmin(ModelAdmin):
-    list_display = ('id', 'username', 'email', 'first_name', 'last_name',)
+    list_display = ('id', 'username', 'email', 'first_name', 'last_name',
+                    'recipes_count', 'followers_count')
     list_filter = ('username', 'email')
     search_fields = ('username', 'email')
     empty_value_display = 'Пусто'
@@ -20,25 +63,42 @@ class UserAdmin(ModelAdmin):
 @register(Recipe)
 class RecipeAdmin(ModelAdmin):
     list_display = ('id', 'name', 'author', 'favorites_count',
-                    )
+                    'shopping_cart_count')
     search_fields = ('name',)
     list_filter = ('name', 'author', 'tags')
     empty_value_display = 'Пусто'
     inlines = (RecipeIngredientInLine,)
 
-    def favorites_count(self, obj):
-        recipe = Recipe.objects.get(id=obj.id)
-        return recipe.favorites.count()
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search_recipes(queryset, search_term), False
+
+    def save_model(self, request, obj, form, change):
+        """Сохранение рецепта со счетчиком рецептов автора.
+
+        При удалении счетчик уменьшает RecipeQuerySet.prepare_delete.
+        """
+        previous_id = form.initial.get('author') if change else None
+        super().save_model(request, obj, form, change)
+        move_counter(obj.author, 'recipes_count', previous_id)
+
+    def save_related(self, request, form, formsets, change):
+        """Сохранение ингредиентов с обновлением сумм списков покупок."""
+        with ShoppingListItem.changing_recipes((form.instance.pk,)):
+            super().save_related(request, form, formsets, change)
 
 
 @register(Follow)
-class FollowAdmin(ModelAdmin):
+class FollowAdmin(CounterAdminMixin, ModelAdmin):
+    counter_target = 'author'
+    counter_field = 'followers_count'
     list_display = ('id', 'user', 'author')
     list_filter = ('user', 'author')
     empty_value_display = 'Пусто'
 
 
-class FavoriteShoppingListBaseAdmin(ModelAdmin):
+class FavoriteShoppingListBaseAdmin(CounterAdminMixin, ModelAdmin):
     list_display = ('id', 'user', 'recipe',)
     list_filter = ('user', 'recipe')
     empty_value_display = 'Пусто'
@@ -46,12 +106,25 @@ class FavoriteShoppingListBaseAdmin(ModelAdmin):
 
 @register(Favorite)
 class FavoriteAdmin(FavoriteShoppingListBaseAdmin):
-    pass
+    counter_target = 'recipe'
+    counter_field = 'favorites_count'
 
 
 @register(ShoppingList)
 class ShoppingListAdmin(FavoriteShoppingListBaseAdmin):
-    pass
+    counter_target = 'recipe'
+    counter_field = 'shopping_cart_count'
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            ShoppingListItem.remove_shopping_lists(
+                ShoppingList.objects.filter(pk=obj.pk))
+        super().save_model(request, obj, form, change)
+        ShoppingListItem.add_recipe((obj.user_id,), obj.recipe_id)
+
+    def delete_queryset(self, request, queryset):
+        ShoppingListItem.remove_shopping_lists(queryset)
+        super().delete_queryset(request, queryset)
 
 
 @register(Ingredient)
@@ -72,3 +145,17 @@ class TagAdmin(ModelAdmin):
 class RecipeIngredientAdmin(ModelAdmin):
     list_display = ('id', 'ingredient', 'amount',)
     empty_value_display = 'Пусто'
+
+    def save_model(self, request, obj, form, change):
+        recipe_ids = {obj.recipe_id, form.initial.get('recipe')} - {None}
+        with ShoppingListItem.changing_recipes(recipe_ids):
+            super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        with ShoppingListItem.changing_recipes((obj.recipe_id,)):
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with ShoppingListItem.changing_recipes(
+                queryset.values_list('recipe_id', flat=True)):
+            super().delete_queryset(request, queryset)
@@ -0,0 +1,123 @@
+"""Синтетический набор данных для бенчмарков и проверки планов запросов."""
+import csv
+import random
+
+from django.conf import settings
+from recipes.models import (Favorite, Follow, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingList, ShoppingListItem,
+                            Tag, User)
+
+from .recount import recount_counters
+
+USERNAME_PREFIX = 'dataset_user'
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+
+
+def load_ingredients():
+    """Ингредиенты из базы, при их отсутствии — из data/ingredients.csv."""
+    if not Ingredient.objects.exists():
+        path = settings.DATA_DIR / 'ingredients.csv'
+        with open(path, newline='', encoding='utf-8') as csvfile:
+            Ingredient.objects.bulk_create(
+                Ingredient(name=name, measurement_unit=measurement_unit)
+                for name, measurement_unit in csv.reader(csvfile)
+            )
+    return list(Ingredient.objects.values_list('id', flat=True))
+
+
+def load_tags():
+    for name, color, slug in TAGS:
+        Tag.objects.get_or_create(
+            slug=slug, defaults={'name': name, 'color': color})
+    return list(Tag.objects.values_list('id', flat=True))
+
+
+def build_dataset(users=50, recipes_per_user=20, ingredients_per_recipe=8,
+                  follows_per_user=10, favorites_per_user=30,
+                  cart_per_user=10, batch_size=1000, seed=0):
+    """Создание пользователей, рецептов и связей между ними.
+
+    Возвращает список созданных пользователей.
+    """
+    rng = random.Random(seed)
+    ingredient_ids = load_ingredients()
+    tag_ids = load_tags()
+
+    first_id = User.objects.filter(
+        username__startswith=USERNAME_PREFIX).count()
+    User.objects.bulk_create(
+        (
+            User(
+                username=f'{USERNAME_PREFIX}{number}',
+                email=f'{USERNAME_PREFIX}{number}@example.com',
+                first_name='Имя', last_name='Фамилия')
+            for number in range(first_id, first_id + users)
+        ),
+        batch_size=batch_size
+    )
+    created_users = list(User.objects.filter(
+        username__startswith=USERNAME_PREFIX).order_by('-id')[:users])
+    user_ids = [user.id for user in created_users]
+
+    Recipe.objects.bulk_create(
+        (
+            Recipe(
+                author_id=user_id, name=f'Рецепт {user_id}-{number}',
+                text='Описание рецепта ' * 10,
+                cooking_time=rng.randint(1, 180),
+                image='recipes/images/dataset.png')
+            for user_id in user_ids
+            for number in range(recipes_per_user)
+        ),
+        batch_size=batch_size
+    )
+    recipe_ids = list(Recipe.objects.filter(
+        author_id__in=user_ids).values_list('id', flat=True))
+
+    Recipe.tags.through.objects.bulk_create(
+        (
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in rng.sample(tag_ids, rng.randint(1, len(tag_ids)))
+        ),
+        batch_size=batch_size
+    )
+    RecipeIngredient.objects.bulk_create(
+        (
+            RecipeIngredient(
+                recipe_id=recipe_id, ingredient_id=ingredient_id,
+                amount=rng.randint(1, 500))
+            for recipe_id in recipe_ids
+            for ingredient_id in rng.sample(
+                ingredient_ids, ingredients_per_recipe)
+        ),
+        batch_size=batch_size
+    )
+    Follow.objects.bulk_create(
+        (
+            Follow(user_id=user_id, author_id=author_id)
+            for user_id in user_ids
+            for author_id in rng.sample(
+                user_ids, min(follows_per_user + 1, len(user_ids)))
+            if author_id != user_id
+        ),
+        batch_size=batch_size, ignore_conflicts=True
+    )
+    for model, per_user in ((Favorite, favorites_per_user),
+                            (ShoppingList, cart_per_user)):
+        model.objects.bulk_create(
+            (
+                model(user_id=user_id, recipe_id=recipe_id)
+                for user_id in user_ids
+                for recipe_id in rng.sample(
+                    recipe_ids, min(per_user, len(recipe_ids)))
+            ),
+            batch_size=batch_size, ignore_conflicts=True
+        )
+    ShoppingListItem.rebuild(batch_size=batch_size)
+    recount_counters()
+    return created_users
@@ -0,0 +1,194 @@
+import json
+import math
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from recipes.models import Recipe
+from rest_framework.authtoken.models import Token
+
+from ._dataset import build_dataset
+
+INGREDIENT_PREFIXES = ('а', 'мо', 'сах', 'кар', 'я', 'tom')
+
+
+def percentile(values, percent):
+    """Перцентиль методом ближайшего ранга."""
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class QueryCounter:
+    """Подсчет запросов и прочитанных строк через execute_wrapper."""
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+        self.rows_known = True
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        self.queries += 1
+        rowcount = context['cursor'].rowcount
+        if sql.lstrip().upper().startswith('SELECT'):
+            if rowcount is None or rowcount < 0:
+                self.rows_known = False
+            else:
+                self.rows += rowcount
+        return result
+
+
+class Command(BaseCommand):
+    help = ('Бенчмарк API: задержка, число запросов к БД '
+            'и прочитанных строк на синтетическом наборе данных')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=50,
+            help='Количество пользователей')
+        parser.add_argument(
+            '--recipes-per-user', type=int, default=20,
+            help='Количество рецептов у каждого пользователя')
+        parser.add_argument(
+            '--ingredients-per-recipe', type=int, default=8,
+            help='Количество ингредиентов в рецепте')
+        parser.add_argument(
+            '--requests', type=int, default=50,
+            help='Количество запросов на каждый сценарий')
+        parser.add_argument(
+            '--warmup', type=int, default=5,
+            help='Количество прогревочных запросов')
+        parser.add_argument(
+            '--output', type=str, default=None,
+            help='Файл для JSON-отчета (по умолчанию stdout)')
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='Сохранить созданные данные в базе')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            users = build_dataset(
+                users=options['users'],
+                recipes_per_user=options['recipes_per_user'],
+                ingredients_per_recipe=options['ingredients_per_recipe'],
+            )
+            user = users[0]
+            token, _ = Token.objects.get_or_create(user=user)
+            recipe = user.recipes.first()
+            report = {
+                'dataset': {
+                    'users': options['users'],
+                    'recipes_per_user': options['recipes_per_user'],
+                    'ingredients_per_recipe': (
+                        options['ingredients_per_recipe']),
+                },
+                'database': connection.vendor,
+                'requests': options['requests'],
+                'scenarios': self.run_scenarios(
+                    token.key, recipe, options),
+            }
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+        content = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(content)
+        else:
+            self.stdout.write(content)
+
+    def get_scenarios(self, recipe):
+        recipes_url = reverse('api:recipes-list')
+        ingredients_url = reverse('api:ingredients-list')
+        last_page = max(
+            Recipe.objects.count() // settings.REST_FRAMEWORK['PAGE_SIZE'], 1)
+        return {
+            'recipes.list': (recipes_url, {}, True),
+            'recipes.list.anonymous': (recipes_url, {}, False),
+            'recipes.list.last_page': (
+                recipes_url, {'page': last_page}, True),
+            'recipes.list.cursor.popular': (
+                recipes_url,
+                {'pagination': 'cursor', 'ordering': 'popular'}, True),
+            'recipes.list.tags': (
+                recipes_url, {'tags': ('breakfast', 'dinner')}, True),
+            'recipes.retrieve': (
+                reverse('api:recipes-detail', kwargs={'pk': recipe.id}),
+                {}, True),
+            'users.subscriptions': (
+                reverse('api:users-subscriptions'),
+                {'recipes_limit': 3}, True),
+            'ingredients.search': (
+                ingredients_url,
+                [{'name': prefix} for prefix in INGREDIENT_PREFIXES],
+                False),
+            'recipes.download_shopping_cart': (
+                reverse('api:recipes-download_shopping_cart'), {}, True),
+        }
+
+    @contextmanager
+    def client(self):
+        allowed_hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+        with override_settings(ALLOWED_HOSTS=allowed_hosts):
+            yield Client()
+
+    def run_scenarios(self, token, recipe, options):
+        results = {}
+        with self.client() as client:
+            for name, (url, params, authenticated) in self.get_scenarios(
+                    recipe).items():
+                headers = (
+                    {'HTTP_AUTHORIZATION': f'Token {token}'}
+                    if authenticated else {}
+                )
+                variants = params if isinstance(params, list) else [params]
+                results[name] = self.run_scenario(
+                    client, url, variants, headers, options)
+        return results
+
+    def run_scenario(self, client, url, variants, headers, options):
+        for number in range(options['warmup']):
+            client.get(url, variants[number % len(variants)], **headers)
+
+        latencies = []
+        queries = []
+        rows = []
+        statuses = set()
+        for number in range(options['requests']):
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                start = time.perf_counter()
+                response = client.get(
+                    url, variants[number % len(variants)], **headers)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                latencies.append((time.perf_counter() - start) * 1000)
+            statuses.add(response.status_code)
+            queries.append(counter.queries)
+            if counter.rows_known:
+                rows.append(counter.rows)
+
+        total_seconds = sum(latencies) / 1000
+        return {
+            'status_codes': sorted(statuses),
+            'latency_ms': {
+                'p50': round(percentile(latencies, 50), 3),
+                'p95': round(percentile(latencies, 95), 3),
+                'p99': round(percentile(latencies, 99), 3),
+                'max': round(max(latencies), 3),
+            },
+            'throughput_rps': round(len(latencies) / total_seconds, 1),
+            'queries_per_request': {
+                'avg': round(sum(queries) / len(queries), 2),
+                'max': max(queries),
+            },
+            'rows_per_request': (
+                round(sum(rows) / len(rows), 1)
+                if len(rows) == len(queries) else None
+            ),
+        }
@@ -0,0 +1,67 @@
+import os
+from datetime import timedelta
+
+from api.images import (AVATAR_VARIANTS, RECIPE_IMAGE_VARIANTS, variant_key,
+                        variant_name)
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from recipes.models import Recipe, User
+
+# Поле с изображением и его уменьшенные копии.
+MEDIA_FIELDS = (
+    (Recipe, 'image', RECIPE_IMAGE_VARIANTS),
+    (User, 'avatar', AVATAR_VARIANTS),
+)
+
+
+def walk(storage, path):
+    """Все файлы каталога path хранилища, включая подкаталоги."""
+    if not storage.exists(path):
+        return
+    directories, files = storage.listdir(path)
+    for name in files:
+        yield os.path.join(path, name)
+    for directory in directories:
+        yield from walk(storage, os.path.join(path, directory))
+
+
+class Command(BaseCommand):
+    help = ('Удаление изображений рецептов и аватаров, '
+            'на которые не ссылается ни одна запись')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age', type=int, default=60,
+            help='Не удалять файлы моложе указанного числа минут')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только вывести файлы, которые будут удалены')
+
+    def handle(self, *args, **options):
+        created_before = timezone.now() - timedelta(
+            minutes=options['min_age'])
+        removed = 0
+        for model, field_name, variants in MEDIA_FIELDS:
+            field = model._meta.get_field(field_name)
+            storage = field.storage
+            referenced = set()
+            for name in model.objects.exclude(
+                    **{field_name: ''}).values_list(
+                    field_name, flat=True).iterator():
+                referenced.add(name)
+                referenced.update(
+                    variant_name(name, variant) for variant in variants)
+            for name in walk(storage, field.upload_to):
+                if (name in referenced
+                        or storage.get_modified_time(name) > created_before):
+                    continue
+                if options['dry_run']:
+                    self.stdout.write(name)
+                else:
+                    storage.delete(name)
+                    cache.delete(variant_key(name))
+                removed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Неиспользуемых файлов: {removed}'
+            + (' (не удалены)' if options['dry_run'] else '')))
@@ -0,0 +1,97 @@
+import re
+from itertools import combinations
+
+from api.views import RecipeViewSet
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rest_framework.test import APIRequestFactory
+
+from ._dataset import build_dataset
+
+# Последовательное чтение таблицы в плане PostgreSQL и SQLite.
+SEQ_SCAN_PATTERNS = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(r'\bSCAN (?:TABLE )?(\w+)(?! USING)(?!\w)'),
+}
+# Справочные таблицы из нескольких строк читаются целиком.
+SMALL_TABLES = ('recipes_tag',)
+
+
+class Command(BaseCommand):
+    help = ('EXPLAIN запросов ленты рецептов для всех сочетаний '
+            'фильтров RecipeFilter с проверкой на полное чтение таблиц')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=50,
+            help='Количество пользователей')
+        parser.add_argument(
+            '--recipes-per-user', type=int, default=20,
+            help='Количество рецептов у каждого пользователя')
+        parser.add_argument(
+            '--verbose-plans', action='store_true',
+            help='Выводить планы всех запросов')
+
+    def handle(self, *args, **options):
+        pattern = SEQ_SCAN_PATTERNS.get(connection.vendor)
+        if pattern is None:
+            raise CommandError(
+                f'База данных {connection.vendor} не поддерживается')
+        with transaction.atomic():
+            user = build_dataset(
+                users=options['users'],
+                recipes_per_user=options['recipes_per_user'],
+            )[0]
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+                if connection.vendor == 'postgresql':
+                    # На небольшом наборе данных планировщик выбирает
+                    # полное чтение, даже если подходящий индекс есть.
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            failures = self.explain_all(user, pattern, options)
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError(
+                'Полное чтение таблиц в запросах с фильтрами: '
+                + '; '.join(failures))
+        self.stdout.write(self.style.SUCCESS(
+            'Все сочетания фильтров используют индексы'))
+
+    def get_filter_params(self, user):
+        return {
+            'author': user.id,
+            'tags': ('breakfast', 'lunch'),
+            'is_favorited': 1,
+            'is_in_shopping_cart': 1,
+        }
+
+    def explain_all(self, user, pattern, options):
+        params = self.get_filter_params(user)
+        failures = []
+        for size in range(len(params) + 1):
+            for names in combinations(params, size):
+                plan = self.explain(
+                    user, {name: params[name] for name in names})
+                tables = sorted(
+                    set(pattern.findall(plan)) - set(SMALL_TABLES))
+                title = ', '.join(names) or 'без фильтров'
+                if tables:
+                    failures.append(f'{title} ({", ".join(tables)})')
+                    self.stderr.write(f'{title}: {", ".join(tables)}')
+                else:
+                    self.stdout.write(f'{title}: OK')
+                if tables or options['verbose_plans']:
+                    self.stdout.write(plan)
+        return failures
+
+    def explain(self, user, params):
+        """План запроса первой страницы ленты, как его строит RecipeViewSet."""
+        view = RecipeViewSet(
+            action_map={'get': 'list'}, format_kwarg=None, kwargs={})
+        request = view.initialize_request(
+            APIRequestFactory().get('/api/recipes/', params))
+        request.user = user
+        view.request = request
+        queryset = view.filter_queryset(view.get_queryset())
+        return queryset[:view.paginator.page_size].explain()
@@ -0,0 +1,24 @@
+from api.images import (AVATAR_VARIANTS, RECIPE_IMAGE_VARIANTS,
+                        generate_variants)
+from django.core.management.base import BaseCommand
+from recipes.models import Recipe, User
+
+
+class Command(BaseCommand):
+    help = ('Создание недостающих уменьшенных копий изображений '
+            'рецептов и аватаров')
+
+    def handle(self, *args, **options):
+        created = 0
+        names = (
+            (Recipe.objects.exclude(image='').values_list(
+                'image', flat=True), RECIPE_IMAGE_VARIANTS),
+            (User.objects.exclude(avatar='').exclude(
+                avatar__isnull=True).values_list(
+                'avatar', flat=True), AVATAR_VARIANTS),
+        )
+        for queryset, variants in names:
+            for name in queryset.iterator():
+                created += generate_variants(name, variants)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано копий изображений: {created}'))
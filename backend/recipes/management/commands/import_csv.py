@@ -1,38 +1,119 @@
 import csv
+import json
+import time
+from itertools import islice
+from pathlib import Path
 
+from api.cache import bump_version
 from django.apps import apps
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, transaction
+
+DEFAULT_FIELDS = ('name', 'measurement_unit')
+BATCH_SIZE = 1000
+
+# Наборы справочных данных в кэше API, которые нужно сбросить после импорта:
+# bulk_create не отправляет сигналы post_save.
+REFERENCE_CACHES = {
+    'ingredient': 'ingredients',
+    'tag': 'tags',
+}
+
+
+def read_csv(path, fields):
+    with open(path, newline='', encoding='utf-8') as csvfile:
+        for row in csv.reader(csvfile):
+            if len(row) != len(fields):
+                yield None
+                continue
+            yield dict(zip(fields, row))
+
+
+def read_json(path, fields):
+    with open(path, encoding='utf-8') as jsonfile:
+        for item in json.load(jsonfile):
+            if not isinstance(item, dict):
+                yield None
+                continue
+            yield {field: item.get(field) for field in fields}
 
 
 class Command(BaseCommand):
-    help = 'Импорт данных из CSV файла в модель'
+    help = 'Импорт данных из CSV или JSON файла в модель'
 
     def add_arguments(self, parser):
-        parser.add_argument('path', type=str, help='Путь к CSV файлу')
+        parser.add_argument(
+            'path', type=str, help='Путь к CSV или JSON файлу')
         parser.add_argument('app_name', type=str, help='Имя приложения')
         parser.add_argument('model_name', type=str, help='Имя модели')
+        parser.add_argument(
+            '--fields', type=str, default=','.join(DEFAULT_FIELDS),
+            help='Поля модели в порядке колонок CSV через запятую')
+        parser.add_argument(
+            '--batch-size', type=int, default=BATCH_SIZE,
+            help='Количество строк в одной транзакции')
 
     def handle(self, *args, **options):
         model = apps.get_model(options['app_name'], options['model_name'])
+        path = Path(options['path'])
+        fields = tuple(options['fields'].split(','))
 
         # Определить список доступных полей модели
         model_fields = {field.name for field in model._meta.fields}
+        unknown_fields = set(fields) - model_fields
+        if unknown_fields:
+            raise CommandError(
+                f'У модели нет полей: {", ".join(sorted(unknown_fields))}')
+
+        reader = read_json if path.suffix.lower() == '.json' else read_csv
+        rows = reader(path, fields)
+
+        start = time.perf_counter()
+        initial_count = model.objects.count()
+        total = failed = 0
+        while True:
+            chunk = list(islice(rows, options['batch_size']))
+            if not chunk:
+                break
+            total += len(chunk)
+            objects = [
+                model(**data) for data in chunk
+                if data and all(data.values())
+            ]
+            failed += len(chunk) - len(objects)
+            failed += self.save_batch(model, objects)
+        inserted = model.objects.count() - initial_count
+        elapsed = time.perf_counter() - start
+
+        cache_name = REFERENCE_CACHES.get(model._meta.model_name)
+        if cache_name and inserted:
+            bump_version(cache_name)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Импорт завершен: добавлено {inserted}, '
+            f'пропущено {total - inserted - failed}, ошибок {failed}, '
+            f'{total / elapsed if elapsed else total:.0f} строк/с'
+        ))
+
+    def save_batch(self, model, objects):
+        """Сохранение пачки объектов в одной транзакции.
 
-        # Открыть и прочитать CSV файл
-        with open(options['path'], newline='', encoding='utf-8') as csvfile:
-            reader = csv.reader(csvfile)
-            headers = ('name', 'measurement_unit')
-            for row in reader:
-                filtered_data = dict(zip(headers, row))
-                # Фильтровать данные только по доступным полям модели
-                filtered_data = {
-                    key: value for key, value in filtered_data.items(
-                    ) if key in model_fields}
-
-                try:
-                    # Создать объект модели
-                    model.objects.create(**filtered_data)
-                except Exception as error:
-                    self.stderr.write(f'Ошибка при создании объекта: {error}')
-
-        self.stdout.write(self.style.SUCCESS('Данные успешно импортированы!'))
+        Уже существующие записи пропускаются. Если пачка не сохранилась,
+        объекты сохраняются по одному, чтобы найти ошибочные строки.
+        Возвращает количество строк с ошибками.
+        """
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create(objects, ignore_conflicts=True)
+            return 0
+        except DatabaseError:
+            pass
+        failed = 0
+        for obj in objects:
+            try:
+                with transaction.atomic():
+                    model.objects.bulk_create((obj,), ignore_conflicts=True)
+            except DatabaseError as error:
+                failed += 1
+                self.stderr.write(f'Ошибка при создании объекта: {error}')
+        return failed
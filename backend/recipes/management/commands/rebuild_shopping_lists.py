@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.models import ShoppingListItem
+
+MAX_REPORTED_MISMATCHES = 20
+
+
+class Command(BaseCommand):
+    help = ('Пересчет таблицы сумм ингредиентов списков покупок '
+            'или проверка ее согласованности (--check)')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только сравнить таблицу с пересчитанными суммами')
+
+    def handle(self, *args, **options):
+        if options['check']:
+            return self.check_consistency()
+        with transaction.atomic():
+            ShoppingListItem.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            'Списки покупок пересчитаны: '
+            f'{ShoppingListItem.objects.count()} записей'))
+
+    def check_consistency(self):
+        expected = {
+            (item['user'], item['ingredient']): item['total']
+            for item in ShoppingListItem.calculate().iterator()
+        }
+        actual = {
+            (user_id, ingredient_id): total_amount
+            for user_id, ingredient_id, total_amount in (
+                ShoppingListItem.objects.values_list(
+                    'user_id', 'ingredient_id', 'total_amount'
+                ).iterator()
+            )
+        }
+        mismatches = [
+            (key, expected.get(key), actual.get(key))
+            for key in expected.keys() | actual.keys()
+            if expected.get(key) != actual.get(key)
+        ]
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS(
+                f'Списки покупок согласованы: {len(actual)} записей'))
+            return
+        for (user_id, ingredient_id), total, stored in sorted(
+                mismatches, key=str)[:MAX_REPORTED_MISMATCHES]:
+            self.stderr.write(
+                f'Пользователь {user_id}, ингредиент {ingredient_id}: '
+                f'ожидается {total}, в таблице {stored}')
+        raise CommandError(
+            f'Найдено расхождений: {len(mismatches)}. '
+            'Запустите rebuild_shopping_lists без --check.')
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from recipes.models import Favorite, Follow, Recipe, ShoppingList, User
+
+# Счетчик: модель, поле счетчика, связанная модель и ее внешний ключ.
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'shopping_cart_count', ShoppingList, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+)
+
+
+def count_subquery(model, field):
+    """Количество записей model, ссылающихся на строку внешнего запроса."""
+    return Coalesce(
+        Subquery(
+            model.objects.filter(
+                **{field: OuterRef('pk')}
+            ).order_by().values(field).annotate(
+                total=Count('pk')
+            ).values('total')
+        ),
+        Value(0)
+    )
+
+
+def recount_counters():
+    """Пересчет всех счетчиков.
+
+    Возвращает количество исправленных строк для каждого счетчика.
+    """
+    drift = {}
+    for model, counter, related_model, field in COUNTERS:
+        expected = count_subquery(related_model, field)
+        with transaction.atomic():
+            drift[f'{model._meta.model_name}.{counter}'] = (
+                model.objects.annotate(
+                    expected=expected
+                ).exclude(**{counter: expected}).count()
+            )
+            model.objects.update(**{counter: expected})
+    return drift
+
+
+class Command(BaseCommand):
+    help = ('Пересчет счетчиков избранного, списков покупок, '
+            'рецептов и подписчиков')
+
+    def handle(self, *args, **options):
+        for counter, fixed in recount_counters().items():
+            self.stdout.write(f'{counter}: исправлено {fixed}')
+        self.stdout.write(self.style.SUCCESS('Счетчики пересчитаны'))
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:13
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Объединение ингредиентов с одинаковыми названием и единицей."""
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(
+        keep_id=Min('id'), total=Count('id')
+    ).filter(total__gt=1)
+    for duplicate in duplicates:
+        extra_ids = Ingredient.objects.filter(
+            name=duplicate['name'],
+            measurement_unit=duplicate['measurement_unit'],
+        ).exclude(id=duplicate['keep_id']).values_list('id', flat=True)
+        recipe_ingredients = RecipeIngredient.objects.filter(
+            ingredient_id__in=list(extra_ids))
+        for recipe_ingredient in recipe_ingredients.order_by('id'):
+            if RecipeIngredient.objects.filter(
+                    recipe_id=recipe_ingredient.recipe_id,
+                    ingredient_id=duplicate['keep_id']).exists():
+                recipe_ingredient.delete()
+            else:
+                recipe_ingredient.ingredient_id = duplicate['keep_id']
+                recipe_ingredient.save(update_fields=('ingredient',))
+        Ingredient.objects.filter(id__in=list(extra_ids)).delete()
+
+
+class Migration(migrations.Migration):
+    """Объединение дубликатов отдельно от ограничения unique_ingredient.
+
+    Внешние ключи в PostgreSQL отложенные: после удаления дубликатов
+    в транзакции остаются события триггеров, и ALTER TABLE в той же
+    транзакции завершается ошибкой "pending trigger events".
+    """
+
+    dependencies = [
+        ('recipes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:17
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+COUNTERS = (
+    ('Recipe', 'favorites_count', 'Favorite', 'recipe'),
+    ('Recipe', 'shopping_cart_count', 'ShoppingList', 'recipe'),
+    ('User', 'recipes_count', 'Recipe', 'author'),
+    ('User', 'followers_count', 'Follow', 'author'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    """Заполнение счетчиков по существующим данным."""
+    for model_name, counter, related_model_name, field in COUNTERS:
+        related_model = apps.get_model('recipes', related_model_name)
+        apps.get_model('recipes', model_name).objects.update(**{
+            counter: Coalesce(
+                Subquery(
+                    related_model.objects.filter(
+                        **{field: OuterRef('pk')}
+                    ).order_by().values(field).annotate(
+                        total=Count('pk')
+                    ).values('total')
+                ),
+                Value(0)
+            )
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлений в избранное'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлений в списки покупок'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество рецептов'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:25
+
+import django.contrib.postgres.search
+from django.db import migrations
+from recipes.search import install_search, uninstall_search
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(install_search, uninstall_search),
+    ]
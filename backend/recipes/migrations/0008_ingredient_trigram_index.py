@@ -0,0 +1,28 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:27
+
+from django.db import migrations
+
+
+def create_trigram_index(apps, schema_editor):
+    """Индекс GIN по триграммам названий ингредиентов (только PostgreSQL)."""
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            'CREATE INDEX ingredient_name_trgm_idx ON recipes_ingredient '
+            'USING gin (name gin_trgm_ops)')
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS ingredient_name_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:32
+
+from django.db import migrations, models
+import recipes.storage
+from recipes.search import install_search
+
+
+def reinstall_search(apps, schema_editor):
+    # SQLite пересоздает таблицу рецептов при AlterField,
+    # вместе с ней удаляются триггеры полнотекстового поиска.
+    if schema_editor.connection.vendor == 'sqlite':
+        install_search(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_ingredient_trigram_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(storage=recipes.storage.HashedMediaStorage(), upload_to='recipes/images/', verbose_name='Фотография рецепта'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='avatar',
+            field=models.ImageField(blank=True, storage=recipes.storage.HashedMediaStorage(), upload_to='users/', verbose_name='Фото профиля'),
+        ),
+        migrations.RunPython(reinstall_search, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_hashed_media_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeIngredientsChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipe_id', models.BigIntegerField(verbose_name='id рецепта')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Время изменения')),
+            ],
+            options={
+                'verbose_name': 'Изменение ингредиентов рецепта',
+                'verbose_name_plural': 'Изменения ингредиентов рецептов',
+            },
+        ),
+    ]
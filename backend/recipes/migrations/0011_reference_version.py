@@ -0,0 +1,24 @@
+# Generated by Django 3.2.3 on 2026-10-18 03:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_ingredients_change'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferenceVersion',
+            fields=[
+                ('name', models.CharField(max_length=200, primary_key=True, serialize=False, verbose_name='Набор данных')),
+                ('version', models.FloatField(verbose_name='Версия')),
+            ],
+            options={
+                'verbose_name': 'Версия справочных данных',
+                'verbose_name_plural': 'Версии справочных данных',
+            },
+        ),
+    ]
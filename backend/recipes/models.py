@@ -1,11 +1,19 @@
-from api.constants import (MAX_COLOR_LENGTH, MAX_EMAIL_LENGTH,
-                           MAX_LENGTH_FIRST_NAME, MAX_LENGTH_LAST_NAME,
-                           MAX_LENGTH_NAME, MAX_LENGTH_SLUG,
-                           MAX_LENGTH_USERNAME, MAX_MEASUREMENT_UNIT_LENGTH)
+from contextlib import contextmanager
+
+from api.constants import (AMOUNT_KEY, INGREDIENT_KEY, MAX_COLOR_LENGTH,
+                           MAX_EMAIL_LENGTH, MAX_LENGTH_FIRST_NAME,
+                           MAX_LENGTH_LAST_NAME, MAX_LENGTH_NAME,
+                           MAX_LENGTH_SLUG, MAX_LENGTH_USERNAME,
+                           MAX_MEASUREMENT_UNIT_LENGTH, NAME_KEY, TOTAL_KEY,
+                           UNIT_KEY)
 from django.contrib.auth.models import AbstractUser
-from django.db import models
-from django.db.models import Q
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models import (Case, Count, Exists, F, OuterRef, Q, Subquery,
+                              Sum, Value, When)
+from django.db.models.functions import Greatest
 
+from .storage import HashedMediaStorage
 from .validators import min_time_validator, validate_username
 
 USER = 'user'
@@ -17,6 +25,33 @@ ROLES = (
 )
 
 
+def change_counter(instance, field, delta):
+    """Атомарное изменение счетчика в базе данных через F().
+
+    Счетчик не опускается ниже нуля, расхождения исправляет
+    команда recount.
+    """
+    type(instance).objects.filter(pk=instance.pk).update(
+        **{field: Greatest(F(field) + delta, 0)})
+
+
+def subtract_counts(model, field, related, related_field):
+    """Уменьшение счетчиков model на число удаляемых записей related.
+
+    related — QuerySet записей, которые ссылаются на model через
+    related_field. Один запрос для любого числа записей; вызывается
+    до удаления, в том числе каскадного.
+    """
+    counts = related.filter(
+        **{related_field: OuterRef('pk')}
+    ).order_by().values(related_field).annotate(
+        total=Count('pk')
+    ).values('total')
+    model.objects.filter(
+        pk__in=related.values(related_field)
+    ).update(**{field: Greatest(F(field) - Subquery(counts), 0)})
+
+
 class User(AbstractUser):
     """Пользователь."""
 
@@ -54,9 +89,20 @@ class User(AbstractUser):
     )
     avatar = models.ImageField(
         upload_to='users/',
+        storage=HashedMediaStorage(),
         blank=True,
         verbose_name='Фото профиля'
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов',
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписчиков',
+    )
 
     @property
     def is_admin(self):
@@ -112,13 +158,48 @@ class Ingredient(models.Model):
         ordering = ('name',)
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='unique_ingredient'
+            )
+        ]
 
     def __str__(self):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    def prepare_delete(self):
+        """Учет удаления рецептов в суммах, журнале и счетчиках.
+
+        Обновляются суммы списков покупок, журнал изменений
+        ингредиентов и recipes_count авторов.
+
+        Вызывается до удаления, пока записи ShoppingList еще есть.
+        Число запросов не зависит от количества рецептов, записей
+        списков покупок и ингредиентов.
+        """
+        ShoppingListItem.remove_shopping_lists(
+            ShoppingList.objects.filter(recipe__in=self.values('pk')))
+        subtract_counts(User, 'recipes_count', self, 'author')
+        RecipeIngredientsChange.log(self.values_list('pk', flat=True))
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            self.prepare_delete()
+            return super().delete()
+
+
 class Recipe(models.Model):
-    """Рецепт."""
+    """Рецепт.
+
+    Удаление через delete() рецепта или QuerySet обновляет суммы
+    списков покупок одним пакетом (RecipeQuerySet.prepare_delete).
+    Каскадное удаление вместе с автором учитывает сигнал pre_delete
+    пользователя (см. api/signals.py).
+    """
 
     author = models.ForeignKey(
         User,
@@ -133,6 +214,7 @@ class Recipe(models.Model):
     image = models.ImageField(
         verbose_name='Фотография рецепта',
         upload_to='recipes/images/',
+        storage=HashedMediaStorage(),
     )
     text = models.TextField(
         verbose_name='Описание рецепта',
@@ -155,11 +237,41 @@ class Recipe(models.Model):
         verbose_name='Дата создания',
         auto_now_add=True,
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавлений в избранное',
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавлений в списки покупок',
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор',
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(
+                fields=('-pub_date', '-id'), name='recipe_new_idx'),
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='recipe_author_new_idx'),
+            models.Index(
+                fields=('-favorites_count', '-id'),
+                name='recipe_popular_idx'),
+            models.Index(
+                fields=('cooking_time', 'id'),
+                name='recipe_cooking_time_idx'),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=('name', 'author'),
@@ -170,6 +282,11 @@ class Recipe(models.Model):
     def __str__(self):
         return self.name
 
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            Recipe.objects.filter(pk=self.pk).prepare_delete()
+            return super().delete(*args, **kwargs)
+
 
 class RecipeTag(models.Model):
     """Модель тегов рецепта."""
@@ -231,6 +348,60 @@ class RecipeIngredient(models.Model):
                 f'{self.amount} {self.ingredient.measurement_unit}')
 
 
+class RecipeIngredientsChange(models.Model):
+    """Изменение ингредиентов рецепта.
+
+    Журнал читают индексы в памяти процессов (api/indexes.py),
+    чтобы обновлять только измененные рецепты. recipe_id не внешний
+    ключ: запись об удаленном рецепте должна остаться в журнале.
+    """
+
+    recipe_id = models.BigIntegerField(verbose_name='id рецепта')
+    created = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='Время изменения',
+    )
+
+    class Meta:
+        verbose_name = 'Изменение ингредиентов рецепта'
+        verbose_name_plural = 'Изменения ингредиентов рецептов'
+
+    @classmethod
+    def log(cls, recipe_ids):
+        """Запись рецептов в журнал одним запросом.
+
+        Вызывается один раз на операцию с рецептами
+        (ShoppingListItem.changing_recipes, RecipeQuerySet.prepare_delete,
+        создание рецепта), а не для каждой строки RecipeIngredient.
+        """
+        cls.objects.bulk_create(
+            cls(recipe_id=recipe_id) for recipe_id in set(recipe_ids))
+
+
+class ReferenceVersion(models.Model):
+    """Версия набора справочных данных (теги, ингредиенты).
+
+    Версия — время последнего изменения. Она хранится в БД, чтобы быть
+    общей для всех процессов и не меняться, когда истекает ее копия
+    в кэше (см. api/cache.py).
+    """
+
+    name = models.CharField(
+        primary_key=True,
+        max_length=MAX_LENGTH_SLUG,
+        verbose_name='Набор данных',
+    )
+    version = models.FloatField(verbose_name='Версия')
+
+    class Meta:
+        verbose_name = 'Версия справочных данных'
+        verbose_name_plural = 'Версии справочных данных'
+
+    def __str__(self):
+        return f'{self.name}: {self.version}'
+
+
 class Follow(models.Model):
     """Подписка на авторов."""
 
@@ -339,3 +510,194 @@ class ShoppingList(models.Model):
 
     def __str__(self):
         return f'{self.user} добавил в список покупок рецепт \"{self.recipe}\"'
+
+
+class ShoppingListItem(models.Model):
+    """Суммарное количество ингредиента в списке покупок пользователя.
+
+    Суммы меняются одним пакетом на операцию: при добавлении и удалении
+    рецепта из списка покупок, изменении ингредиентов рецепта
+    (API и админка) и удалении рецептов, в том числе каскадном вместе
+    с автором. Изменения строк RecipeIngredient в обход этих путей
+    не учитываются; пересчитать таблицу заново можно командой
+    rebuild_shopping_lists.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Ингредиент'
+    )
+    total_amount = models.IntegerField(
+        default=0,
+        verbose_name='Общее количество',
+    )
+
+    class Meta:
+        verbose_name = 'Ингредиент списка покупок'
+        verbose_name_plural = 'Ингредиенты списков покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} - {self.total_amount}'
+
+    @staticmethod
+    def get_ingredients(user):
+        """Список покупок пользователя из таблицы сумм."""
+        return user.shopping_list_items.values(
+            INGREDIENT_KEY, NAME_KEY, UNIT_KEY
+        ).annotate(
+            **{TOTAL_KEY: F('total_amount')}
+        ).order_by(NAME_KEY, INGREDIENT_KEY)
+
+    @classmethod
+    def apply(cls, user_ids, amounts):
+        """Изменение сумм ингредиентов в списках покупок пользователей.
+
+        amounts — словарь {id ингредиента: изменение количества}.
+        Число запросов не зависит от количества пользователей.
+        Строки создаются только для положительных изменений, поэтому
+        при каскадном удалении пользователя на него не появятся
+        новые ссылки.
+        """
+        amounts = {
+            ingredient_id: amount
+            for ingredient_id, amount in amounts.items() if amount
+        }
+        user_ids = list(user_ids)
+        if not user_ids or not amounts:
+            return
+        cls.objects.bulk_create(
+            (
+                cls(user_id=user_id, ingredient_id=ingredient_id)
+                for user_id in user_ids
+                for ingredient_id, amount in amounts.items() if amount > 0
+            ),
+            ignore_conflicts=True
+        )
+        cls.objects.filter(
+            user_id__in=user_ids, ingredient_id__in=amounts
+        ).update(total_amount=F('total_amount') + Case(
+            *(
+                When(ingredient_id=ingredient_id, then=Value(amount))
+                for ingredient_id, amount in amounts.items()
+            ),
+            default=Value(0),
+            output_field=models.IntegerField()
+        ))
+        cls.objects.filter(
+            user_id__in=user_ids, ingredient_id__in=amounts,
+            total_amount__lte=0
+        ).delete()
+
+    @staticmethod
+    def get_recipe_amounts(recipe, sign=1):
+        """Количества ингредиентов рецепта {id ингредиента: количество}.
+
+        recipe — рецепт или его id.
+        """
+        return {
+            ingredient_id: sign * amount
+            for ingredient_id, amount in RecipeIngredient.objects.filter(
+                recipe=recipe).values_list(INGREDIENT_KEY, AMOUNT_KEY)
+        }
+
+    @classmethod
+    def change_recipe(cls, recipe, amounts):
+        """Изменение сумм у всех пользователей, у которых рецепт в списке."""
+        cls.apply(
+            ShoppingList.objects.filter(recipe=recipe).values_list(
+                'user_id', flat=True),
+            amounts)
+
+    @classmethod
+    def update_recipe(cls, recipe, previous):
+        """Перенос изменения ингредиентов рецепта в суммы.
+
+        previous — количества до изменения (get_recipe_amounts).
+        """
+        amounts = cls.get_recipe_amounts(recipe)
+        for ingredient_id, amount in previous.items():
+            amounts[ingredient_id] = amounts.get(ingredient_id, 0) - amount
+        cls.change_recipe(recipe, amounts)
+
+    @classmethod
+    @contextmanager
+    def changing_recipes(cls, recipe_ids):
+        """Изменение ингредиентов рецептов внутри блока with.
+
+        После блока разница количеств переносится в суммы одним
+        пакетом на рецепт, а рецепты записываются в журнал изменений.
+        """
+        recipe_ids = set(recipe_ids)
+        previous = {
+            recipe_id: cls.get_recipe_amounts(recipe_id)
+            for recipe_id in recipe_ids
+        }
+        yield
+        for recipe_id, amounts in previous.items():
+            cls.update_recipe(recipe_id, amounts)
+        RecipeIngredientsChange.log(recipe_ids)
+
+    @classmethod
+    def remove_shopping_lists(cls, shopping_lists):
+        """Вычитание записей ShoppingList из сумм до их удаления.
+
+        shopping_lists — QuerySet записей. Одно обновление
+        с коррелированным подзапросом и удаление обнулившихся строк.
+        """
+        removed = RecipeIngredient.objects.filter(
+            recipe__shopping_list__in=shopping_lists.values('pk'),
+            recipe__shopping_list__user=OuterRef('user'),
+            ingredient=OuterRef('ingredient')
+        ).order_by().values(INGREDIENT_KEY).annotate(
+            total=Sum(AMOUNT_KEY)
+        ).values('total')
+        items = cls.objects.filter(Exists(removed))
+        items.update(total_amount=F('total_amount') - Subquery(removed))
+        items.filter(total_amount__lte=0).delete()
+
+    @classmethod
+    def add_recipe(cls, user_ids, recipe):
+        cls.apply(user_ids, cls.get_recipe_amounts(recipe))
+
+    @classmethod
+    def remove_recipe(cls, user_ids, recipe):
+        cls.apply(user_ids, cls.get_recipe_amounts(recipe, sign=-1))
+
+    @staticmethod
+    def calculate():
+        """Суммы ингредиентов всех списков покупок, посчитанные заново."""
+        return RecipeIngredient.objects.filter(
+            recipe__shopping_list__isnull=False
+        ).values(
+            INGREDIENT_KEY, user=F('recipe__shopping_list__user')
+        ).annotate(
+            **{TOTAL_KEY: Sum(AMOUNT_KEY)}
+        ).order_by()
+
+    @classmethod
+    def rebuild(cls, batch_size=1000):
+        """Пересчет таблицы по спискам покупок."""
+        cls.objects.all().delete()
+        cls.objects.bulk_create(
+            (
+                cls(user_id=item['user'],
+                    ingredient_id=item[INGREDIENT_KEY],
+                    total_amount=item[TOTAL_KEY])
+                for item in cls.calculate().iterator()
+            ),
+            batch_size=batch_size
+        )
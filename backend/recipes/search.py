@@ -0,0 +1,114 @@
+"""Полнотекстовый поиск рецептов по названию и описанию.
+
+В PostgreSQL поиск идет по столбцу search_vector (tsvector со словарем
+russian, название важнее описания) с индексом GIN. Столбец заполняет
+триггер при вставке и изменении рецепта. В SQLite, которая используется
+для тестов, вместо него работает таблица FTS5 с триггерами.
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F, FloatField
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+
+SEARCH_VECTOR_SQL = (
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', "
+    "coalesce({row}name, '')), 'A') || "
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', "
+    "coalesce({row}text, '')), 'B')"
+)
+INSTALL_SQL = {
+    'postgresql': (
+        'CREATE OR REPLACE FUNCTION recipes_recipe_search_vector() '
+        'RETURNS trigger AS $$ BEGIN '
+        f'NEW.search_vector := {SEARCH_VECTOR_SQL.format(row="NEW.")}; '
+        'RETURN NEW; END $$ LANGUAGE plpgsql',
+        'CREATE TRIGGER recipes_recipe_search_vector '
+        'BEFORE INSERT OR UPDATE OF name, text ON recipes_recipe '
+        'FOR EACH ROW EXECUTE PROCEDURE recipes_recipe_search_vector()',
+        'UPDATE recipes_recipe SET search_vector = '
+        f'{SEARCH_VECTOR_SQL.format(row="")}',
+        'CREATE INDEX recipe_search_idx ON recipes_recipe '
+        'USING gin (search_vector)',
+    ),
+    'sqlite': (
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+        "name, text, content='recipes_recipe', content_rowid='id')",
+        f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert '
+        'AFTER INSERT ON recipes_recipe BEGIN '
+        f'INSERT INTO {FTS_TABLE} (rowid, name, text) '
+        'VALUES (new.id, new.name, new.text); END',
+        f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete '
+        'AFTER DELETE ON recipes_recipe BEGIN '
+        f'INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, name, text) '
+        "VALUES ('delete', old.id, old.name, old.text); END",
+        f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update '
+        'AFTER UPDATE OF name, text ON recipes_recipe BEGIN '
+        f'INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, name, text) '
+        "VALUES ('delete', old.id, old.name, old.text); "
+        f'INSERT INTO {FTS_TABLE} (rowid, name, text) '
+        'VALUES (new.id, new.name, new.text); END',
+        f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')",
+    ),
+}
+UNINSTALL_SQL = {
+    'postgresql': (
+        'DROP INDEX IF EXISTS recipe_search_idx',
+        'DROP TRIGGER IF EXISTS recipes_recipe_search_vector '
+        'ON recipes_recipe',
+        'DROP FUNCTION IF EXISTS recipes_recipe_search_vector()',
+    ),
+    'sqlite': (
+        f'DROP TRIGGER IF EXISTS {FTS_TABLE}_insert',
+        f'DROP TRIGGER IF EXISTS {FTS_TABLE}_delete',
+        f'DROP TRIGGER IF EXISTS {FTS_TABLE}_update',
+        f'DROP TABLE IF EXISTS {FTS_TABLE}',
+    ),
+}
+
+
+def install_search(apps, schema_editor):
+    """Индекс и триггеры поиска для текущей базы данных.
+
+    В SQLite триггеры удаляются при пересоздании таблицы рецептов,
+    поэтому миграции, которые ее пересоздают, вызывают функцию повторно.
+    """
+    for sql in INSTALL_SQL.get(schema_editor.connection.vendor, ()):
+        schema_editor.execute(sql, params=None)
+
+
+def uninstall_search(apps, schema_editor):
+    for sql in UNINSTALL_SQL.get(schema_editor.connection.vendor, ()):
+        schema_editor.execute(sql, params=None)
+
+
+def search_recipes(queryset, query):
+    """Рецепты, подходящие под запрос, по убыванию релевантности rank."""
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch')
+        # ts_rank возвращает real. В double precision значение
+        # точно переживает курсор KeysetPagination, иначе сравнение
+        # rank < значение из курсора пропускает или повторяет строки.
+        return queryset.filter(search_vector=search_query).annotate(
+            rank=Cast(SearchRank(F('search_vector'), search_query),
+                      FloatField())
+        ).order_by('-rank', '-id')
+
+    words = re.findall(r'\w+', query)
+    if not words:
+        return queryset.none()
+    match = ' '.join(f'"{word}"' for word in words)
+    return queryset.filter(id__in=RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+        (match,)
+    )).annotate(rank=RawSQL(
+        f'SELECT -bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} '
+        f'WHERE {FTS_TABLE} MATCH %s AND rowid = recipes_recipe.id',
+        (match,), output_field=FloatField()
+    )).order_by('-rank', '-id')
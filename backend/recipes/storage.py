@@ -0,0 +1,42 @@
+"""Хранилище медиафайлов с именами по содержимому.
+
+Файл сохраняется под именем sha256 своего содержимого в подкаталогах
+по первым символам хеша: recipes/images/3f/a2/3fa2....png. Одинаковые
+изображения хранятся один раз, а адрес файла никогда не меняет
+содержимое, поэтому nginx отдает его с долгим кэшированием.
+Файлы, на которые больше не ссылаются модели, удаляет команда
+collect_media.
+"""
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class HashedMediaStorage(FileSystemStorage):
+
+    def hashed_name(self, name, content):
+        """Имя файла по хешу содержимого в каталоге исходного имени."""
+        sha256 = hashlib.sha256()
+        for chunk in content.chunks():
+            sha256.update(chunk)
+        digest = sha256.hexdigest()
+        dirname, basename = os.path.split(name)
+        ext = os.path.splitext(basename)[1].lower()
+        return os.path.join(dirname, digest[:2], digest[2:4], digest + ext)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            # Обновляем время изменения, чтобы collect_media
+            # не удалил файл, который снова стал нужен.
+            os.utime(self.path(name))
+            return name
+        return super().save(name, content, max_length)